@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+"""Time the scanning stages on synthetic KDE sized inputs.
+
+Generates a tree of unpacked source packages, with long changelogs
+and dsc files, and a Packages file for them, then times each stage of
+the outdated and build order pipelines and reports throughput and
+peak memory.
+
+  python3 -m ooddr.benchmark --packages 500 --stanzas 60000
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+CHANGELOG_ENTRY = """{name} ({version}) unstable; urgency=low
+
+  * Synthetic entry number {entry}.
+
+ -- Debian Qt/KDE Maintainers <debian-qt-kde@lists.debian.org>  Wed, 02 Jan 2013 03:45:57 +0000
+
+"""
+
+WATCH = """version=3
+ftp://ftp.kde.org/pub/kde/stable/([\\d\\.]*)/src/{name}-([\\d\\.]*).tar.xz
+"""
+
+def source_name(group, i):
+    return 'kde{}-pkg{}'.format(group, i)
+
+def make_source_tree(root, groups=4, packages=100, changelog_entries=200,
+                     binaries=3):
+    """Create groups directories of unpacked source packages under root
+
+    Each package build-depends on the previous one in its group, so
+    the dependency graph has long chains. Returns the number of
+    packages created.
+    """
+    for group in range(groups):
+        for i in range(packages):
+            name = source_name(group, i)
+            version = '4.{}.{}'.format(group, i)
+            source_dir = os.path.join(root, 'group{}'.format(group), name)
+            package_dir = os.path.join(source_dir,
+                                       '{}-{}'.format(name, version))
+            debian_dir = os.path.join(package_dir, 'debian')
+            os.makedirs(debian_dir)
+
+            build_depends = ['debhelper (>= 9)', 'cmake | cmake3']
+            if i > 0:
+                build_depends.append('lib{}-dev (>= 4.0)'.format(
+                    source_name(group, i - 1)))
+            with open(os.path.join(debian_dir, 'control'), 'w') as stream:
+                stream.write('Source: {}\nMaintainer: Debian Qt/KDE '
+                             'Maintainers <debian-qt-kde@lists.debian.org>\n'
+                             'Build-Depends: {}\n\n'.format(
+                                 name, ', '.join(build_depends)))
+                for b in binary_names(name, binaries):
+                    stream.write('Package: {}\nArchitecture: any\n'
+                                 'Description: {}\n a synthetic package\n\n'
+                                 .format(b, b))
+
+            with open(os.path.join(debian_dir, 'changelog'), 'w') as stream:
+                for entry in range(changelog_entries, 0, -1):
+                    stream.write(CHANGELOG_ENTRY.format(
+                        name=name, version='{}-{}'.format(version, entry),
+                        entry=entry))
+
+            with open(os.path.join(debian_dir, 'watch'), 'w') as stream:
+                stream.write(WATCH.format(name=name))
+
+            dsc = os.path.join(source_dir, '{}_{}-1.dsc'.format(name, version))
+            orig = '{}_{}.orig.tar.xz'.format(name, version)
+            with open(dsc, 'w') as stream:
+                stream.write('Format: 3.0 (quilt)\nSource: {0}\n'
+                             'Version: {1}-1\nFiles:\n'
+                             ' d41d8cd98f00b204e9800998ecf8427e 0 {2}\n'
+                             'Checksums-Sha256:\n'
+                             ' e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934'
+                             'ca495991b7852b855 0 {2}\n'.format(
+                                 name, version, orig))
+    return groups * packages
+
+def binary_names(name, binaries):
+    names = ['lib{}-dev'.format(name)]
+    for b in range(1, binaries):
+        names.append('{}-bin{}'.format(name, b))
+    return names
+
+def make_packages_file(filename, stanzas=60000, groups=4, packages=100,
+                       binaries=3):
+    """Write a Packages file with stanzas entries
+
+    The binaries of the synthetic tree come first, half of them at an
+    older version, and the rest is filler like the rest of an archive.
+    """
+    count = 0
+    with open(filename, 'w') as stream:
+        for group in range(groups):
+            for i in range(packages):
+                name = source_name(group, i)
+                revision = 1 if i % 2 else 300
+                for b in binary_names(name, binaries):
+                    write_stanza(stream, b, name,
+                                 '4.{}.{}-{}'.format(group, i, revision))
+                    count += 1
+        while count < stanzas:
+            write_stanza(stream, 'filler{}'.format(count),
+                         'filler{}'.format(count // 5),
+                         '1.{}-1'.format(count))
+            count += 1
+    return count
+
+def write_stanza(stream, package, source, version):
+    stream.write('Package: {0}\nSource: {1}\nVersion: {2}\n'
+                 'Architecture: amd64\nMaintainer: Someone '
+                 '<someone@example.org>\nInstalled-Size: 1024\n'
+                 'Depends: libc6 (>= 2.13), libstdc++6 (>= 4.6)\n'
+                 'Filename: pool/main/{1}/{0}_{2}_amd64.deb\nSize: 4096\n'
+                 'MD5sum: d41d8cd98f00b204e9800998ecf8427e\n'
+                 'Description: {0}\n a synthetic binary package\n .\n'
+                 ' with a long description\n\n'.format(
+                     package, source, version))
+
+def measure(name, items, function, *args, **kwargs):
+    """Run function and return its result with a timing record
+
+    Peak memory is only measured if tracemalloc is already tracing,
+    as tracing slows everything down.
+    """
+    peak = None
+    if tracemalloc.is_tracing():
+        tracemalloc.clear_traces()
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    cpu = time.process_time()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        peak = peak / 2.0 ** 20
+    return result, {
+        'stage': name,
+        'items': items,
+        'seconds': elapsed,
+        'cpu_seconds': cpu,
+        'items_per_second': items / elapsed if elapsed else None,
+        'peak_mb': peak,
+    }
+
+def run(root, packages_file, package_count, stanza_count, jobs=None):
+    """Time every stage on an already generated tree
+
+    Returns a list of timing records.
+    """
+    from . import pdood, builddeps
+
+    results = []
+    files, r = measure('find_debian_files', package_count,
+                       pdood.find_debian_files, root, jobs)
+    results.append(r)
+    tables, r = measure('build_package_tables', package_count,
+                        pdood.build_package_tables, files, jobs)
+    results.append(r)
+    source, needs, provides = tables
+    repository, r = measure('build_repository_table', stanza_count,
+                            pdood.build_repository_table, packages_file)
+    results.append(r)
+    outdated, r = measure('find_newer_source', len(source),
+                          pdood.find_newer_source, source, repository)
+    results.append(r)
+    packages, r = measure('scan_project_tree', package_count,
+                          builddeps.scan_project_tree, root)
+    results.append(r)
+    index, r = measure('add_repository_data', stanza_count,
+                       builddeps.add_repository_data, packages, packages_file)
+    results.append(r)
+    graph, r = measure('build_package_graph', package_count,
+                       builddeps.build_package_graph, packages, index)
+    results.append(r)
+    return results
+
+def format_results(results):
+    lines = ['{:<24} {:>9} {:>10} {:>10} {:>14} {:>9}'.format(
+        'stage', 'items', 'seconds', 'cpu', 'items/s', 'peak MB')]
+    for r in results:
+        peak = '-' if r['peak_mb'] is None else '{:.1f}'.format(r['peak_mb'])
+        lines.append('{:<24} {:>9} {:>10.3f} {:>10.3f} {:>14.1f} {:>9}'
+                     .format(r['stage'], r['items'], r['seconds'],
+                             r['cpu_seconds'], r['items_per_second'] or 0,
+                             peak))
+    return '\n'.join(lines)
+
+def main(cmdline=None):
+    parser = make_parser()
+    args = parser.parse_args(cmdline)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ooddr_bench_')
+    root = os.path.join(workdir, 'tree')
+    packages_file = os.path.join(workdir, 'Packages')
+    per_group = max(1, args.packages // args.groups)
+    try:
+        if not os.path.exists(root):
+            make_source_tree(root, args.groups, per_group, args.changelog)
+            make_packages_file(packages_file, args.stanzas, args.groups,
+                               per_group)
+        if args.memory:
+            tracemalloc.start()
+        results = run(root, packages_file, args.groups * per_group,
+                      args.stanzas, args.jobs)
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+
+    if args.json:
+        print(json.dumps(results, indent=1))
+    else:
+        print(format_results(results))
+
+def make_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--packages', type=int, default=400,
+                        help='number of source packages to generate')
+    parser.add_argument('--groups', type=int, default=4,
+                        help='number of directories to spread them over')
+    parser.add_argument('--changelog', type=int, default=200,
+                        help='number of entries in each changelog')
+    parser.add_argument('--stanzas', type=int, default=60000,
+                        help='number of stanzas in the Packages file')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of processes to scan with')
+    parser.add_argument('--workdir',
+                        help='keep the generated inputs in this directory '
+                             'and reuse them on later runs')
+    parser.add_argument('--memory', action='store_true',
+                        help='also measure peak memory of each stage, '
+                             'which makes them slower')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as json')
+    return parser
+
+if __name__ == '__main__':
+    main()
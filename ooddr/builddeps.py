@@ -1,79 +1,129 @@
 #!/usr/bin/python3
 """Build dependency lists.
 """
+import argparse
+import json
 import os, sys
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from glob import glob
-from pprint import pprint
 
-import networkx as nx
-
-from debian.deb822 import Deb822, _PkgRelationMixin, Dsc, Packages
+from debian.deb822 import Deb822, _PkgRelationMixin, Dsc, PkgRelation
 from .changelog import OrderedChangelog
-from apt.cache import Cache
+from .packages import REPOSITORY_FIELDS, SOURCES_FIELDS, PackagesIndex, \
+    open_index, iter_stanzas, is_compressed, split_source_field, \
+    index_list, parse_index_spec, is_sources_index
+from .version import version_string, interned_key
+from . import stats
+
+# every field with build dependencies of a source paragraph
+BUILD_DEPENDS_FIELDS = ('build-depends', 'build-depends-indep',
+                        'build-depends-arch')
 
 class Control(Deb822, _PkgRelationMixin):
-    _relationship_fields = ['build-depends',]
+    _relationship_fields = list(BUILD_DEPENDS_FIELDS)
     def __init__(self, *args, **kwargs):
         Deb822.__init__(self, *args, **kwargs)
         _PkgRelationMixin.__init__(self, *args, **kwargs)
 
 class SourcePackage(object):
+    """What the build graph needs to know about one source package
+
+    Only the names, relations and versions are kept from the control
+    paragraphs, the paragraphs themselves aren't. needs is every
+    build dependency and build_depends the same Needs grouped into
+    their alternatives. Of the dsc files and the repository only the
+    newest version is remembered.
+    """
+    __slots__ = ('name', 'version', 'package_dir', 'build_depends', 'needs',
+                 'provides', 'dsc_version', 'repository_version',
+                 '_repository_key')
+
     def __init__(self, package_list, version, package_dir):
-        self.source = package_list[0]
-        self.binaries = package_list[1:]
+        source = package_list[0]
+        self.name = source['Source']
         self.version = version
         self.package_dir = package_dir
-        self.dsc = []
-        self.repository = []
-
-    def _get_name(self):
-        return self.source['Source']
-    name = property(_get_name)
-
-    def _get_needs(self):
-        for build_deps in self.source.relations['build-depends']:
-            for dep in build_deps:
-                yield Needs(dep['name'], dep['version'], dep)
-    needs = property(_get_needs)
-                    
-    def _get_provides(self):
-        for p in self.binaries:
-            yield Provides(p['package'], None, p)
-    provides = property(_get_provides)
+        self.build_depends = tuple(
+            tuple(Needs(dep['name'], dep['version'], group)
+                  for dep in alternatives)
+            for group, alternatives in enumerate(
+                alternatives for field in BUILD_DEPENDS_FIELDS
+                for alternatives in source.relations[field]))
+        self.needs = tuple(dep for alternatives in self.build_depends
+                           for dep in alternatives)
+        self.provides = tuple(
+            Provides(p['Package'], None, parse_provides(p.get('Provides')))
+            for p in package_list[1:])
+        self.dsc_version = None
+        self.repository_version = None
+        self._repository_key = None
+
+    def add_repository_version(self, version):
+        """Remember version if it is the newest one in the repository
+        """
+        key = interned_key(version)
+        if self._repository_key is None or key > self._repository_key:
+            self.repository_version = version
+            self._repository_key = key
 
     def _get_dscoutdated(self):
-        if self.dsc:
-            return self.version > self.dsc[0]['Version']
+        if self.dsc_version is not None:
+            return self.version > self.dsc_version
         return True
     dscoutdated = property(_get_dscoutdated)
 
     def _get_outdated(self):
-        if self.repository:
-            for pkg in self.repository:
-                if self.version > pkg['Version']:
-                    return True
-            return False
-        elif self.dsc:
+        if self.repository_version is not None:
+            return self.version > self.repository_version
+        elif self.dsc_version is not None:
             return self.dscoutdated
     outdated = property(_get_outdated)
         
     def __repr__(self):
-        return self.source['Source']
+        return self.name
         
 class Provides(object):
-    def __init__(self, binary, version, source):
+    """A binary package built by a source and its virtual packages
+    """
+    __slots__ = ('binary', 'version', 'virtuals')
+
+    def __init__(self, binary, version, virtuals=()):
         self.binary = binary
         self.version = version
-        self.source = source
+        self.virtuals = tuple(virtuals)
 
 class Needs(object):
-    def __init__(self, binary, version_expression, source):
+    """One alternative of a build dependency
+
+    group numbers the Build-Depends relation it is an alternative of.
+    """
+    __slots__ = ('binary', 'version_expression', 'group')
+
+    def __init__(self, binary, version_expression, group):
         self.binary = binary
         self.version_expression = version_expression
-        self.source = source
+        self.group = group
 
-def read_debian_dir(package_dir):
+def read_debian_dir(package_dir, cache=None):
     '''Read the debian directory contained in package_dir'''
+    if cache is not None:
+        debian_dir = os.path.join(package_dir, 'debian')
+        filenames = [os.path.join(debian_dir, 'control'),
+                     os.path.join(debian_dir, 'changelog')]
+        paragraphs, package_version = cache.fetch(
+            'builddeps-package', package_dir, filenames, read_debian_records)
+    else:
+        paragraphs, package_version = read_debian_records(package_dir)
+
+    package = [Control(p) for p in paragraphs]
+    return SourcePackage(package, package_version, package_dir)
+
+def read_debian_records(package_dir):
+    '''Read the control paragraphs as dictionaries and the changelog'''
     debian_dir = os.path.join(package_dir, 'debian')
     if not os.path.exists(debian_dir):
         raise IOError(
@@ -87,24 +137,45 @@ def read_debian_dir(package_dir):
 
     control = Control()
     with open(control_filename, 'r') as stream:
-        package = list(control.iter_paragraphs(stream))
-        return SourcePackage(package, package_version, package_dir)
+        package = [dict(p) for p in control.iter_paragraphs(stream)]
+        return package, package_version
 
 def read_changelog(stream):
     """Find current version
     """
-    return OrderedChangelog(stream)
+    log = OrderedChangelog()
+    log.parse_changelog_head(stream, strict=False)
+    return log
+
+def read_dsc(filename):
+    """Read a dsc file into a plain dictionary
+    """
+    with open(filename) as stream:
+        dsc = Dsc(stream)
+        return {k: [dict(x) for x in v] if isinstance(v, list) else v
+                for k, v in dsc.items()}
 
-def scan_project_tree(root):
+@stats.timed('scan_project_tree')
+def scan_project_tree(root, cache=None):
     """Look through a project tree for debian control files
+
+    If a ScanCache is passed, only packages and dscs that changed
+    since it was saved are parsed.
     """
     sources = {}
     dscs = {}
+    collecting = stats.active()
     for dirpath, dirnames, filenames in os.walk(root, topdown=True):
         indexes_to_delete =[]
         for i, d in enumerate(dirnames):
             if d == 'debian':
-                source_pkg = read_debian_dir(dirpath)
+                if collecting is None:
+                    source_pkg = read_debian_dir(dirpath, cache)
+                else:
+                    start = time.perf_counter()
+                    source_pkg = read_debian_dir(dirpath, cache)
+                    collecting.item('package', dirpath,
+                                    time.perf_counter() - start)
                 sources[source_pkg.name] = source_pkg
             elif d in ('.git', '.bzr'):
                 indexes_to_delete.append(i)
@@ -112,61 +183,407 @@ def scan_project_tree(root):
             del dirnames[i]
         for f in filenames:
             if f.endswith('.dsc'):
-                with open(os.path.join(dirpath, f)) as stream:
-                    dsc_pkg = Dsc(stream)
-                    dscs.setdefault(dsc_pkg['Source'], []).append(dsc_pkg)
+                dsc_filename = os.path.join(dirpath, f)
+                if cache is not None:
+                    dsc_pkg = cache.fetch('builddeps-dsc', dsc_filename,
+                                          [dsc_filename], read_dsc)
+                else:
+                    dsc_pkg = read_dsc(dsc_filename)
+                dscs.setdefault(dsc_pkg['Source'], []).append(
+                    dsc_pkg['Version'])
 
     for dsc_name in dscs:
         source_pkg = sources.get(dsc_name, None)
         if source_pkg:
-            source_pkg.dsc = sorted(dscs[dsc_name], 
-                                    key=lambda x: x['Version'],
-                                    reverse=True)
+            source_pkg.dsc_version = max(dscs[dsc_name], key=interned_key)
     return sources
 
-def add_repository_data(packages, package_path):
-    source_from_bin = build_source_from_bin(packages)
+class BinaryIndex(object):
+    """Map binary and virtual package names to where they come from.
+
+    Built once per scan and shared by add_repository_data and
+    build_package_graph. Local binaries map to the SourcePackage that
+    builds them and names only available from the repository map to
+    their repository source name. Real binary packages win over
+    virtual packages provided by something else. versions keeps the
+    newest source version of every repository binary.
+    """
+    def __init__(self, packages=None):
+        self.binaries = {}
+        self.virtuals = {}
+        self.repository = {}
+        self.versions = {}
+        if packages is not None:
+            self.add_sources(packages)
+
+    def clear_sources(self):
+        """Forget the local packages but keep the repository
+        """
+        self.binaries = {}
+        self.virtuals = {}
 
-    with open(package_path) as stream:
-        repository = Packages().iter_paragraphs(stream)
+    def add_sources(self, packages):
+        for pkg_name in packages:
+            pkg = packages[pkg_name]
+            for provided in pkg.provides:
+                self.binaries[provided.binary] = pkg
+                for virtual in provided.virtuals:
+                    self.virtuals.setdefault(virtual, pkg)
 
-        for r in repository:
-            bin_pkg_name = r.get('Package')
-            if bin_pkg_name:
-                source = source_from_bin.get(bin_pkg_name)
-                if source:
-                    source.repository.append(r)
+    def add_repository(self, stanza):
+        """Record the binary and virtual packages of a Packages stanza
+        """
+        binary = stanza.get('Package')
+        if not binary:
+            return
+        source, version = split_source_field(stanza.get('Source') or binary)
+        self.repository[binary] = source
+        self._add_version(binary, version or stanza.get('Version'))
+        for virtual in parse_provides(stanza.get('Provides')):
+            self.repository.setdefault(virtual, source)
+
+    def add_repository_source(self, stanza):
+        """Record the binary packages listed in a Sources stanza
+        """
+        source = stanza.get('Package')
+        version = stanza.get('Version')
+        if not source or not version:
+            return
+        for binary in (stanza.get('Binary') or '').split(','):
+            binary = binary.strip()
+            if binary:
+                # a Packages stanza for the binary knows better
+                self.repository.setdefault(binary, source)
+                self._add_version(binary, version)
+
+    def _add_version(self, binary, version):
+        known = self.versions.get(binary)
+        if known is None or (known != version and
+                             interned_key(version) > interned_key(known)):
+            self.versions[binary] = version
+
+    def add_repository_versions(self, packages):
+        """Tell the local packages the newest version of their binaries
+        """
+        for pkg_name in packages:
+            pkg = packages[pkg_name]
+            for provided in pkg.provides:
+                version = self.versions.get(provided.binary)
+                if version is not None:
+                    pkg.add_repository_version(version)
+
+    def local_source(self, name):
+        """Return the local SourcePackage providing name or None
+        """
+        source = self.binaries.get(name)
+        if source is None:
+            source = self.virtuals.get(name)
+        return source
+
+    def resolve(self, alternatives):
+        """Find what satisfies one build dependency
+
+        alternatives is a list of Needs, like the ones in
+        SourcePackage.build_depends. The first alternative that is
+        built locally or is in the repository wins, like it does for
+        sbuild.
+
+        Returns the local SourcePackage, the repository source name or
+        None if nothing provides any of the alternatives.
+        """
+        for relation in alternatives:
+            name = relation.binary
+            source = self.local_source(name)
+            if source is not None:
+                return source
+            source = self.repository.get(name)
+            if source is not None:
+                return source
+        return None
+
+def parse_provides(provides):
+    """Return the package names in a Provides field
+    """
+    if not provides:
+        return []
+    return [alternatives[0]['name']
+            for alternatives in PkgRelation.parse_relations(provides)]
+
+@stats.timed('add_repository_data')
+def add_repository_data(packages, package_files, index=None, offsets=False):
+    """Add the repository binaries to the index and the local packages
+
+    package_files is one Packages or Sources index or a list of them.
+    If offsets is true, for the uncompressed Packages files only the
+    stanzas of the binaries built by the packages and of what they
+    build depend on are read, using a PackagesIndex.
+    """
+    if index is None:
+        index = BinaryIndex(packages)
+
+    names = None
+    stanzas = 0
+    for spec in index_list(package_files):
+        filename = parse_index_spec(spec)[0]
+        if is_sources_index(filename):
+            fields, add = SOURCES_FIELDS, index.add_repository_source
+        else:
+            fields, add = REPOSITORY_FIELDS, index.add_repository
+        if offsets and not is_compressed(filename) and \
+           not is_sources_index(filename):
+            if names is None:
+                names = set()
+                for pkg in packages.values():
+                    names.update(provided.binary for provided in pkg.provides)
+                    names.update(need.binary for need in pkg.needs)
+            with PackagesIndex(filename) as offset_index:
+                tables = (offset_index.packages, offset_index.provides)
+                for r in offset_index.lookup(names, tables=tables):
+                    stanzas += 1
+                    add(r)
+        else:
+            with open_index(filename) as stream:
+                for r in iter_stanzas(stream, fields):
+                    stanzas += 1
+                    add(r)
+        stats.count('files read')
+        stats.count('bytes read', os.path.getsize(filename))
+    index.add_repository_versions(packages)
+    stats.count('stanzas', stanzas)
+    return index
 
 def build_source_from_bin(packages):
-    source_from_bin = {}
-    for pkg_name in packages:
-        pkg = packages[pkg_name]
-        for provided in pkg.provides:
-            source_from_bin[provided.binary] = pkg
-    return source_from_bin
+    return BinaryIndex(packages).binaries
     
-def build_package_graph(packages):
+@stats.timed('build_package_graph')
+def build_package_graph(packages, index=None):
     # map provided binary packages to source packages
-    source_from_bin = build_source_from_bin(packages)
+    if index is None:
+        index = BinaryIndex(packages)
     
+    import networkx as nx
     deps = nx.DiGraph()
     for pkg_name in packages:
         pkg = packages[pkg_name]
-        for need in pkg.needs:
-            source = source_from_bin.get(need.binary)
-            if source:
+        deps.add_node(pkg)
+        for alternatives in pkg.build_depends:
+            source = index.resolve(alternatives)
+            if isinstance(source, SourcePackage) and source is not pkg:
                     deps.add_edge(source, pkg)
 
     return deps
     
-def find_build_order(root, packages_path=None):
+def find_build_order(root, packages_path=None, cache=None, offsets=False):
     """Scan through a tree
+
+    packages_path is one repository index or a list of them.
     """
             
-    packages = scan_project_tree(root)
-    add_repository_data(packages, packages_path)
-    return build_package_graph(packages)
-    
+    packages = scan_project_tree(root, cache)
+    index = BinaryIndex(packages)
+    if packages_path:
+        add_repository_data(packages, packages_path, index, offsets)
+    return build_package_graph(packages, index)
+
+def rebuild_subgraph(deps):
+    """Return the part of the dependency graph that needs to be built
+
+    That is every outdated package and everything that build-depends
+    on them, directly or not.
+    """
+    import networkx as nx
+    nodes = set()
+    for node in deps:
+        if node.outdated and node not in nodes:
+            nodes.add(node)
+            nodes.update(nx.descendants(deps, node))
+    return deps.subgraph(nodes)
+
+@stats.timed('plan_builds')
+def plan_builds(deps, costs=None, default_cost=1.0):
+    """Plan how to rebuild the outdated part of a dependency graph
+
+    costs maps source package names to how long they take to build,
+    for example durations from a previous run. Packages without a
+    cost count as default_cost.
+
+    Packages on a build dependency cycle, like a bootstrap loop, are
+    planned as one step, in the same wave and costing the sum of
+    their costs.
+
+    Returns a tuple
+      waves         - lists of packages, each list only depends on
+                      the lists before it and can build concurrently
+      critical_path - the chain of packages that bounds the total time
+      duration      - the summed cost of the critical path
+    """
+    import networkx as nx
+    if costs is None:
+        costs = {}
+    by_name = lambda x: x.name
+    graph = nx.condensation(rebuild_subgraph(deps))
+    members = {step: sorted(graph.nodes[step]['members'], key=by_name)
+               for step in graph}
+    waves = [sorted((node for step in wave for node in members[step]),
+                    key=by_name)
+             for wave in nx.topological_generations(graph)]
+
+    finish = {}
+    previous = {}
+    for step in nx.topological_sort(graph):
+        before = None
+        for pred in graph.predecessors(step):
+            if before is None or finish[pred] > finish[before]:
+                before = pred
+        start = finish[before] if before is not None else 0
+        finish[step] = start + sum(costs.get(node.name, default_cost)
+                                   for node in members[step])
+        previous[step] = before
+
+    critical_path = []
+    if finish:
+        step = max(finish, key=finish.get)
+        duration = finish[step]
+        while step is not None:
+            critical_path[:0] = members[step]
+            step = previous[step]
+    else:
+        duration = 0
+    return waves, critical_path, duration
+
+
+def load_build_state(state_file):
+    """Read the per package status and duration of previous builds
+    """
+    if state_file is None or not os.path.exists(state_file):
+        return {}
+    with open(state_file) as stream:
+        return json.load(stream)
+
+def save_build_state(state_file, state):
+    temp_filename = state_file + '.tmp'
+    with open(temp_filename, 'w') as stream:
+        json.dump(state, stream, indent=1, sort_keys=True)
+    os.replace(temp_filename, state_file)
+
+def build_durations(state):
+    """Return the build costs recorded in a build state for plan_builds
+    """
+    return {name: info['duration'] for name, info in state.items()
+            if 'duration' in info}
+
+def run_builds(deps, command, jobs=1, state_file=None):
+    """Build the outdated part of a dependency graph
+
+    command is a list of arguments, the package directory is appended
+    to it for each build. A package is started as soon as everything
+    it build-depends on has built, with at most jobs builds running
+    at once. Packages depending on a failed build are skipped, and
+    the packages on a build dependency cycle are built one after
+    another as one step.
+
+    The status and duration of each build is written to state_file as
+    it finishes, and packages recorded there as done at the same
+    version are not built again, unless something they build-depend on
+    was rebuilt, so an interrupted run can be resumed. A build command
+    that can't be run counts as a failed build.
+
+    Returns a dictionary of package name to status.
+    """
+    import networkx as nx
+    graph = rebuild_subgraph(deps)
+    # a build dependency cycle is built as one step, one package after
+    # another, like plan_builds plans it
+    steps = nx.condensation(graph)
+    members = {step: sorted(steps.nodes[step]['members'],
+                            key=lambda x: x.name)
+               for step in steps}
+    state = load_build_state(state_file)
+    state_lock = threading.Lock()
+    status = {}
+    rebuilt = set()
+    pending = {step: steps.in_degree(step) for step in steps}
+
+    def up_to_date(step):
+        for node in members[step]:
+            previous = state.get(node.name, {})
+            if previous.get('status') != 'done' or \
+               previous.get('version') != version_string(node.version) or \
+               any(pred in rebuilt for pred in graph.predecessors(node)):
+                return False
+        return True
+
+    def finished(step, results):
+        for node, result in results:
+            status[node.name] = result
+        succeeded = len(results) == len(members[step]) and \
+            all(result == 'done' for node, result in results)
+        skip_members(step)
+        for succ in steps.successors(step):
+            pending[succ] -= 1
+            if not succeeded:
+                skip(succ)
+            elif pending[succ] == 0 and not is_skipped(succ):
+                ready.append(succ)
+
+    def is_skipped(step):
+        return members[step][0].name in status
+
+    def skip_members(step):
+        for node in members[step]:
+            status.setdefault(node.name, 'skipped')
+
+    def skip(step):
+        if not is_skipped(step):
+            skip_members(step)
+            for succ in steps.successors(step):
+                skip(succ)
+
+    def build_one(node):
+        start = time.time()
+        try:
+            returncode = subprocess.call(list(command) + [node.package_dir])
+        except OSError as e:
+            print('WARNING: could not build', node.name, e, file=sys.stderr)
+            returncode = None
+        result = 'done' if returncode == 0 else 'failed'
+        with state_lock:
+            state[node.name] = {'status': result,
+                                'duration': time.time() - start,
+                                'version': version_string(node.version)}
+            if state_file is not None:
+                save_build_state(state_file, state)
+        return result
+
+    def build(step):
+        results = []
+        for node in members[step]:
+            results.append((node, build_one(node)))
+            if results[-1][1] != 'done':
+                # the rest of a cycle needs this one
+                break
+        return results
+
+    ready = [step for step in steps if pending[step] == 0]
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while ready or running:
+            while ready:
+                step = ready.pop(0)
+                if up_to_date(step):
+                    finished(step, [(node, 'done') for node in members[step]])
+                else:
+                    running[executor.submit(build, step)] = step
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                results = future.result()
+                rebuilt.update(node for node, result in results)
+                finished(step, results)
+    return status
 
 def print_digraph(needs, source):
     print("digraph {")
@@ -183,19 +600,59 @@ def print_digraph(needs, source):
                 print('NA -> "{0}";'.format(n.binary))
     print("}")
 
-def compute_orig(source):
+def compute_orig(source, tarballs=None):
+    """Find the orig tarball of a source package
+
+    Looks next to the unpacked source, or anywhere in the tree if a
+    checksums.TarballIndex is passed.
+    """
     name = source.name
     version = source.version.upstream_version
     pathname = os.path.normpath(os.path.join(source.package_dir, '..'))
 
+    if tarballs is not None:
+        orig_files = tarballs.find_origs(name, version, pathname)
+        return orig_files[0] if orig_files else None
+
     orig_pattern = name + '_' + version + '.orig.*'
     orig_files = glob(os.path.join(pathname, orig_pattern))
     if orig_files:
         return orig_files[0]
 
 def main(cmdline=None):
-    deps = find_build_order('/home/diane/kde/src/kde-sc')
-    pprint( [ d for d in nx.topological_sort(deps) if d.outdated ] )
+    parser = make_parser()
+    args = parser.parse_args(cmdline)
+
+    deps = find_build_order(args.root, args.packages, offsets=args.index)
+    costs = build_durations(load_build_state(args.state))
+    waves, critical_path, duration = plan_builds(deps, costs)
+    for i, wave in enumerate(waves):
+        print('wave {}:'.format(i), ' '.join(p.name for p in wave))
+    print('critical path ({}):'.format(duration),
+          ' -> '.join(p.name for p in critical_path))
+
+    if args.build:
+        status = run_builds(deps, shlex.split(args.build), args.jobs,
+                            args.state)
+        for name in sorted(status):
+            print(name, status[name])
+
+def make_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', nargs='?', default='/home/diane/kde/src/kde-sc')
+    parser.add_argument('-p', '--packages', action='append',
+                        help='Packages or Sources file, may be given once '
+                             'per suite and architecture')
+    parser.add_argument('-i', '--index', action='store_true',
+                        help='keep a byte offset index next to the Packages '
+                             'files and only read the stanzas needed')
+    parser.add_argument('-b', '--build',
+                        help='command to build a package directory with')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of builds to run at once')
+    parser.add_argument('-s', '--state',
+                        help='file to record build results in')
+    return parser
     
 if __name__ == "__main__":
     main()
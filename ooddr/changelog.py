@@ -3,15 +3,62 @@ from debian.debian_support import BaseVersion
 
 from debian.changelog import ChangelogParseError
 
+from .version import version_key
+
+def read_changelog_head(stream):
+    """Return the lines of the first entry of a changelog
+
+    Stops reading at the trailer line of the first entry.
+    """
+    lines = []
+    for line in stream:
+        lines.append(line)
+        if line.startswith(' -- '):
+            break
+    return lines
+
 class OrderedChangelog(debian.changelog.Changelog, BaseVersion):
     """Changelog class that can be compared to Versions.
 
     It inherits from debian.changelog.Changelog and adds
     a bit to be comparable to debian.debian_support.BaseVersions.
     """
+    filename = None
+    _key = None
+    _key_version = None
+
     def __repr__(self):
         return "%s('%s')" % (self.__class__.__name__, self.get_version())
 
+    def parse_changelog_head(self, file, **kwargs):
+        """Parse only the first entry of a changelog
+
+        That is all we need to know the current version, and it avoids
+        reading and parsing the whole history of long lived packages.
+        If file is a stream with a name, parse_full can read the rest
+        of it later.
+        """
+        self.filename = getattr(file, 'name', None)
+        self.parse_changelog(read_changelog_head(file), max_blocks=1, **kwargs)
+
+    def parse_full(self, **kwargs):
+        """Parse every entry of a changelog read with parse_changelog_head
+        """
+        if self.filename is None:
+            raise ValueError('No changelog filename to read')
+        with open(self.filename, 'r') as stream:
+            self.parse_changelog(stream, **kwargs)
+
+    def _get_key(self):
+        # get_version builds a new Version object on every call, so
+        # remember which raw version string the key was made from
+        version = self._blocks[0]._raw_version if self._blocks else None
+        if self._key is None or version != self._key_version:
+            self._key = version_key(version)
+            self._key_version = version
+        return self._key
+    key = property(_get_key)
+
     def _compare(self, other):
         if self is other:
             return 0
@@ -20,7 +67,9 @@ class OrderedChangelog(debian.changelog.Changelog, BaseVersion):
         if other is None:
             return 1
 
-        if isinstance(other, OrderedChangelog):
-            other = other.get_version()
+        other_key = getattr(other, 'key', None)
+        if not isinstance(other_key, bytes):
+            other_key = version_key(other)
 
-        return self.get_version()._compare(other)
+        key = self.key
+        return (key > other_key) - (key < other_key)
@@ -0,0 +1,132 @@
+"""Find the tarballs under a tree and check them against dsc files.
+
+Digests are computed by a pool of threads, hashlib releases the GIL
+while hashing large blocks so they really do run in parallel, and can
+be kept in a ScanCache so unchanged files are only hashed once.
+"""
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from .core import scan_dir
+from .scancache import cached_map
+
+CHUNK_SIZE = 1 << 20
+
+_TARBALL = re.compile(r'\.(tar\.(gz|bz2|xz|lzma|zst)|tgz|diff\.gz)$')
+_ORIG = re.compile(r'^(?P<source>[^_]+)_(?P<version>[^_]+)'
+                   r'\.orig(-[A-Za-z0-9][A-Za-z0-9-]*)?\.tar\.[a-z0-9]+$')
+
+
+class TarballIndex(object):
+    """Every tarball under a tree, by file name and by orig version
+
+    names maps a file name to the paths it was found at and origs maps
+    (source, upstream version) to the paths of the orig tarballs for
+    it, including component tarballs.
+    """
+    def __init__(self, paths=()):
+        self.names = {}
+        self.origs = {}
+        for path in paths:
+            self.add(path)
+
+    def __len__(self):
+        return sum(len(paths) for paths in self.names.values())
+
+    def add(self, path):
+        name = os.path.basename(path)
+        self.names.setdefault(name, []).append(path)
+        match = _ORIG.match(name)
+        if match:
+            key = (match.group('source'), match.group('version'))
+            self.origs.setdefault(key, []).append(path)
+
+    def find(self, name, directory=None):
+        """Return a path for the file name, preferring one in directory
+        """
+        paths = self.names.get(name, [])
+        for path in paths:
+            if os.path.dirname(path) == directory:
+                return path
+        if paths:
+            return paths[0]
+        # signatures and other files that aren't tarballs
+        if directory is not None and \
+           os.path.exists(os.path.join(directory, name)):
+            return os.path.join(directory, name)
+        return None
+
+    def find_origs(self, source, upstream_version, directory=None):
+        """Return the orig tarballs of an upstream version
+
+        Those in directory come first.
+        """
+        paths = self.origs.get((source, upstream_version), [])
+        return sorted(paths, key=lambda p: os.path.dirname(p) != directory)
+
+
+def find_tarballs(root):
+    """Build a TarballIndex of root
+
+    Like the debian file scan this doesn't descend into vcs
+    directories or unpacked source trees.
+    """
+    index = TarballIndex()
+    for pathname, dirnames, filenames in os.walk(root, topdown=True):
+        if ('package', pathname) in scan_dir(pathname, dirnames, filenames):
+            continue
+        for f in filenames:
+            if _TARBALL.search(f):
+                index.add(os.path.join(pathname, f))
+    return index
+
+def sha256_file(filename, chunk_size=CHUNK_SIZE):
+    """Return the hex sha256 of a file, read in chunks
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(filename, 'rb', buffering=0) as stream:
+        while True:
+            size = stream.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+def hash_files(paths, jobs=4, cache=None):
+    """Return a dictionary of path to sha256 for every path
+
+    The files are hashed by jobs threads. If a ScanCache is passed
+    only files whose stamp changed are hashed again.
+    """
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        digests = cached_map(cache, 'sha256', sha256_file, paths,
+                             lambda path: [path], pool.map)
+    return dict(zip(paths, digests))
+
+def size_matches(path, size):
+    """Does the file at path exist and have the size listed in a dsc?
+    """
+    try:
+        return os.path.getsize(path) == int(size)
+    except (OSError, TypeError, ValueError):
+        return False
+
+def check_file(path, size, sha256, digests):
+    """Return the status of one file listed in a dsc
+
+    size and sha256 are from the dsc and digests is from hash_files.
+    The status is ok, missing, size or sha256. Files listed without a
+    sha256 are only checked by size.
+    """
+    if path is None or not os.path.exists(path):
+        return 'missing'
+    if not size_matches(path, size):
+        return 'size'
+    if isinstance(sha256, str) and digests.get(path) != sha256:
+        return 'sha256'
+    return 'ok'
@@ -0,0 +1,190 @@
+"""Lightweight scanning with plain records.
+
+Nothing here imports pandas, networkx or python-debian, so simple
+questions like "which sources are under this root" or "is this package
+outdated" can be answered by scripts and hooks without paying for
+loading the heavier modules.
+"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from .packages import PackagesIndex, open_index, iter_stanzas, \
+    is_compressed, split_source_field, index_list, parse_index_spec, \
+    is_sources_index
+from .version import version_key
+
+VCS_DIRS = ('.git', '.hg', '.bzr', '.svn')
+
+_CHANGELOG_HEADING = re.compile(r'^(\S+) \(([^()\s]+)\)')
+
+def walk_debian_files(root):
+    """Return ('package', directory) and ('dsc', filename) tuples for root
+    """
+    debian_files = []
+    for pathname, dirnames, filenames in os.walk(root, topdown=True):
+        debian_files.extend(scan_dir(pathname, dirnames, filenames))
+    return debian_files
+
+def scan_dir(pathname, dirnames, filenames):
+    """Look for debian sources in one directory of an os.walk
+
+    Prunes dirnames in place so the walk doesn't decend into vcs
+    directories or below an unpacked source tree.
+    """
+    debian_files = []
+    # don't decend into vcs dirs
+    to_delete = set()
+    for i, d in enumerate(dirnames):
+        if d == 'debian':
+            to_delete.add(i)
+            changelog = os.path.join(pathname, 'debian', 'changelog')
+            control = os.path.join(pathname, 'debian', 'control')
+            if os.path.exists(changelog) and os.path.exists(control):
+                debian_files.append(('package', pathname))
+                to_delete = set(range(len(dirnames)))
+                # deleting here doesn't work, dirnames
+                # seems protected by the for loop
+        elif d in VCS_DIRS:
+            to_delete.add(i)
+
+    for i in sorted(to_delete)[::-1]:
+        del dirnames[i]
+
+    for f in filenames:
+        if f.endswith('.dsc'):
+            debian_files.append(('dsc', os.path.join(pathname, f)))
+
+    return debian_files
+
+def read_source_record(package_dir):
+    """Read the source name and current version of an unpacked source
+
+    Only the Source field of debian/control and the first line of
+    debian/changelog are read. Returns a dictionary with Source,
+    Version and Directory.
+    """
+    debian_dir = os.path.join(package_dir, 'debian')
+    name = None
+    with open(os.path.join(debian_dir, 'control')) as stream:
+        for line in stream:
+            if not line.strip():
+                if name is not None:
+                    break
+                continue
+            key, sep, value = line.partition(':')
+            if sep and key.lower() == 'source':
+                name = value.strip()
+                break
+
+    version = None
+    with open(os.path.join(debian_dir, 'changelog')) as stream:
+        for line in stream:
+            if line.strip():
+                match = _CHANGELOG_HEADING.match(line)
+                if match:
+                    version = match.group(2)
+                    if name is None:
+                        name = match.group(1)
+                break
+
+    return {'Source': name, 'Version': version, 'Directory': package_dir}
+
+def iter_sources(root):
+    """Yield a source record for every unpacked source under root
+    """
+    for pathname, dirnames, filenames in os.walk(root, topdown=True):
+        for kind, filename in scan_dir(pathname, dirnames, filenames):
+            if kind == 'package':
+                yield read_source_record(filename)
+
+def repository_versions(package_files, names=None, offsets=False, jobs=None):
+    """Return the newest version of each source in Packages files
+
+    package_files is one index or a list of them, Sources indices are
+    read too. Binaries whose version differs from their source, like
+    binNMUs, count with the source version from their Source field. If
+    names is given only those source packages are kept, and if offsets
+    is true too only their stanzas are read with a PackagesIndex.
+
+    Several indices are read in parallel by jobs processes, one per
+    index up to the number of cpus by default, and the newest version
+    anywhere is kept.
+    """
+    filenames = [parse_index_spec(spec)[0]
+                 for spec in index_list(package_files)]
+    read = partial(_index_versions, names=names, offsets=offsets)
+    if jobs is None:
+        jobs = min(len(filenames), os.cpu_count() or 1)
+    if jobs <= 1 or len(filenames) < 2:
+        found = [read(filename) for filename in filenames]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            found = list(pool.map(read, filenames))
+
+    if len(found) == 1:
+        return found[0]
+    newest = {}
+    for versions in found:
+        for source, version in versions.items():
+            known = newest.get(source)
+            if known is None or (known != version and
+                                 version_key(version) > version_key(known)):
+                newest[source] = version
+    return newest
+
+def _index_versions(filename, names=None, offsets=False):
+    fields = ('Package', 'Source', 'Version')
+    if names is not None and offsets and not is_compressed(filename) \
+       and not is_sources_index(filename):
+        with PackagesIndex(filename) as index:
+            return _newest_versions(
+                index.lookup(names, fields, tables=(index.sources,)), names)
+
+    with open_index(filename) as stream:
+        return _newest_versions(iter_stanzas(stream, fields), names)
+
+def _newest_versions(stanzas, names=None):
+    newest = {}
+    for stanza in stanzas:
+        source = stanza.get('Source') or stanza.get('Package')
+        version = stanza.get('Version')
+        if source is None or version is None:
+            continue
+        source, source_version = split_source_field(source)
+        if source_version is not None:
+            version = source_version
+        if names is not None and source not in names:
+            continue
+        known = newest.get(source)
+        # the binaries of a source mostly share its version, only
+        # compute keys when they differ
+        if known is None or (known != version and
+                             version_key(version) > version_key(known)):
+            newest[source] = version
+    return newest
+
+def is_outdated(record, versions):
+    """Is a source record newer than the version in the repository?
+
+    versions is a dictionary from repository_versions. Sources missing
+    from the repository are not outdated.
+    """
+    repository_version = versions.get(record['Source'])
+    if repository_version is None or record['Version'] is None:
+        return False
+    return version_key(record['Version']) > version_key(repository_version)
+
+def iter_outdated(root, versions):
+    """Yield the sources under root that are newer than the repository
+
+    versions is a dictionary from repository_versions, so only it is
+    kept in memory while the tree is walked. Each record gets a
+    Repository key with the repository version and is yielded as soon
+    as its package is read.
+    """
+    for record in iter_sources(root):
+        if is_outdated(record, versions):
+            record['Repository'] = versions[record['Source']]
+            yield record
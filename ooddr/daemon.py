@@ -0,0 +1,412 @@
+#!/usr/bin/python3
+"""Keep a scanned tree in memory and answer queries about it.
+
+The daemon scans the root once, keeps the source packages, the binary
+index and the dependency graph, and re-reads only the packages whose
+debian files change. Changes are noticed with inotify if pyinotify is
+installed, otherwise by polling the file stamps.
+
+Queries are json objects, one per line, sent over a unix socket:
+
+  {"query": "outdated"}
+  {"query": "order"}
+  {"query": "rdeps", "name": "kdelibs"}
+  {"query": "rebuild", "names": ["kdelibs", "kdepimlibs"]}
+
+and every answer is one line with either a result or an error.
+
+  python3 -m ooddr.daemon -p Packages -s /tmp/ooddr.sock <project root>
+"""
+import argparse
+import errno
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from .builddeps import BinaryIndex, read_debian_dir, read_dsc, \
+    add_repository_data, build_package_graph, plan_builds
+from .core import VCS_DIRS, walk_debian_files
+from .depgraph import DepGraph
+from .scancache import file_stamp
+from .version import interned_key, version_string
+
+
+class Tree(object):
+    """The source packages under a root, kept up to date
+
+    entries maps each package directory and dsc file to the stamps of
+    the files it was read from and what was read. A package is only
+    read again if one of its stamps changed, and the graph is only
+    rebuilt when something was read again. packages_files is one
+    repository index or a list of them.
+    """
+    def __init__(self, root, packages_files=None):
+        self.root = os.path.realpath(root)
+        self.packages_files = packages_files
+        self.entries = {}
+        self.index = BinaryIndex()
+        self.lock = threading.RLock()
+        self.pending = set()
+        self._packages = None
+        self._graph = None
+        self._depgraph = None
+        if packages_files:
+            self.load_repository()
+        self.scan()
+
+    def load_repository(self):
+        add_repository_data({}, self.packages_files, self.index)
+
+    def _read(self, kind, path):
+        if kind == 'package':
+            debian_dir = os.path.join(path, 'debian')
+            filenames = [os.path.join(debian_dir, 'control'),
+                         os.path.join(debian_dir, 'changelog')]
+        else:
+            filenames = [path]
+        stamps = tuple(file_stamp(f) for f in filenames)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == stamps and entry[1] == kind:
+            return False
+
+        try:
+            if kind == 'package':
+                record = read_debian_dir(path)
+            else:
+                dsc = read_dsc(path)
+                record = (dsc['Source'], dsc['Version'])
+        except Exception as e:
+            # a half written file, try again on the next change
+            print('WARNING:', path, e)
+            self.entries.pop(path, None)
+            return True
+        self.entries[path] = (stamps, kind, record)
+        return True
+
+    def scan(self):
+        """Walk the whole tree, reading new and changed packages
+
+        Returns whether anything changed.
+        """
+        with self.lock:
+            seen = set()
+            changed = False
+            for kind, path in walk_debian_files(self.root):
+                seen.add(path)
+                changed |= self._read(kind, path)
+            for path in set(self.entries) - seen:
+                del self.entries[path]
+                changed = True
+            self.pending.clear()
+            if changed:
+                self._graph = None
+            return changed
+
+    def changed(self, path):
+        """Note that path changed, it is looked at before the next query
+        """
+        with self.lock:
+            self.pending.add(path)
+
+    def package_dir(self, path):
+        """Return the known package directory containing path or None
+        """
+        while path != self.root and len(path) > len(self.root):
+            if path in self.entries and self.entries[path][1] == 'package':
+                return path
+            path = os.path.dirname(path)
+        return None
+
+    def apply_pending(self):
+        """Re-read the packages whose debian files changed
+
+        A change outside of the known packages, like a new dsc or a new
+        unpacked source, needs a walk of the tree. Changes to the
+        upstream sources of a package are ignored.
+        """
+        with self.lock:
+            if not self.pending:
+                return False
+            pending, self.pending = self.pending, set()
+            rescan = False
+            dirty = set()
+            for path in pending:
+                package_dir = self.package_dir(path)
+                if package_dir is None:
+                    rescan = True
+                elif path.startswith(os.path.join(package_dir, 'debian')):
+                    dirty.add(package_dir)
+            if rescan:
+                return self.scan()
+
+            changed = False
+            for package_dir in dirty:
+                if os.path.exists(os.path.join(package_dir, 'debian')):
+                    changed |= self._read('package', package_dir)
+                else:
+                    del self.entries[package_dir]
+                    changed = True
+            if changed:
+                self._graph = None
+            return changed
+
+    def graph(self):
+        """Return the dependency graph, rebuilding it if needed
+        """
+        with self.lock:
+            self.apply_pending()
+            if self._graph is None:
+                packages = {}
+                dscs = {}
+                for stamps, kind, record in self.entries.values():
+                    if kind == 'package':
+                        record.dsc_version = None
+                        packages[record.name] = record
+                    else:
+                        dscs.setdefault(record[0], []).append(record[1])
+                for name, versions in dscs.items():
+                    if name in packages:
+                        packages[name].dsc_version = max(versions,
+                                                         key=interned_key)
+                self.index.clear_sources()
+                self.index.add_sources(packages)
+                self.index.add_repository_versions(packages)
+                self._packages = packages
+                self._graph = build_package_graph(packages, self.index)
+                self._depgraph = None
+            return self._graph
+
+    def depgraph(self):
+        """Return a DepGraph of the graph with its closure computed
+        """
+        with self.lock:
+            graph = self.graph()
+            if self._depgraph is None:
+                self._depgraph = DepGraph.from_networkx(graph)
+                self._depgraph.compute_closure()
+            return self._depgraph
+
+    def outdated(self):
+        graph = self.graph()
+        return [{'Source': pkg.name,
+                 'Version': version_string(pkg.version),
+                 'Repository': pkg.repository_version,
+                 'Dsc': pkg.dsc_version,
+                 'Directory': pkg.package_dir}
+                for pkg in sorted(graph, key=lambda p: p.name)
+                if pkg.outdated]
+
+    def order(self):
+        waves, critical_path, duration = plan_builds(self.graph())
+        return {'waves': [[p.name for p in wave] for wave in waves],
+                'critical_path': [p.name for p in critical_path],
+                'duration': duration}
+
+    def source_name(self, name):
+        """Return the local source of a source or binary package name
+        """
+        with self.lock:
+            self.graph()
+            pkg = self._packages.get(name) or self.index.local_source(name)
+        if pkg is None:
+            raise ValueError('{} is not built by the tree'.format(name))
+        return pkg.name
+
+    def rdeps(self, name):
+        """Return the sources that build depend on name, directly or not
+
+        name may be a source or a binary package built from one.
+        """
+        return self.depgraph().rdeps(self.source_name(name))
+
+    def rebuild(self, names):
+        """Return what has to be rebuilt if the names change, in order
+        """
+        return self.depgraph().rebuild_set(
+            [self.source_name(name) for name in names])
+
+    def query(self, request):
+        """Answer one decoded request
+        """
+        root = request.get('root')
+        if root is not None and os.path.realpath(root) != self.root:
+            raise ValueError('this daemon serves {}'.format(self.root))
+
+        query = request.get('query')
+        if query == 'outdated':
+            return self.outdated()
+        elif query == 'order':
+            return self.order()
+        elif query == 'rdeps':
+            return self.rdeps(request['name'])
+        elif query == 'rebuild':
+            return self.rebuild(request['names'])
+        elif query == 'ping':
+            return 'pong'
+        raise ValueError('unknown query {!r}'.format(query))
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                answer = {'result': self.server.tree.query(json.loads(line))}
+            except Exception as e:
+                answer = {'error': str(e)}
+            self.wfile.write(json.dumps(answer).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class QueryServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, tree):
+        if os.path.exists(socket_path):
+            if socket_in_use(socket_path):
+                raise OSError(errno.EADDRINUSE,
+                              'another daemon is listening on', socket_path)
+            # left over from a daemon that didn't shut down cleanly
+            os.unlink(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path,
+                                               QueryHandler)
+        self.tree = tree
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def socket_in_use(socket_path):
+    """Is something listening on the unix socket at socket_path?
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except ConnectionRefusedError:
+        return False
+    finally:
+        conn.close()
+    return True
+
+
+class Poller(threading.Thread):
+    """Rescan the tree every interval seconds
+    """
+    def __init__(self, tree, interval=5.0):
+        threading.Thread.__init__(self, daemon=True)
+        self.tree = tree
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.tree.scan()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def watch_inotify(tree):
+    """Tell tree about changes with inotify
+
+    Only the directories down to the debian directories of the
+    packages are watched, not the upstream sources. Returns the
+    running notifier.
+    """
+    def exclude(path):
+        if os.path.basename(path) in VCS_DIRS:
+            return True
+        package_dir = tree.package_dir(path)
+        return package_dir is not None and path != package_dir and \
+            not path.startswith(os.path.join(package_dir, 'debian'))
+
+    class Handler(pyinotify.ProcessEvent):
+        def process_default(self, event):
+            tree.changed(event.pathname)
+
+    manager = pyinotify.WatchManager()
+    mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | \
+        pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO
+    notifier = pyinotify.ThreadedNotifier(manager, Handler())
+    notifier.daemon = True
+    manager.add_watch(tree.root, mask, rec=True, auto_add=True,
+                      exclude_filter=exclude)
+    notifier.start()
+    return notifier
+
+
+def query(socket_path, request, timeout=60):
+    """Send one request to a daemon and return its result
+
+    Raises RuntimeError with the message of the daemon if it couldn't
+    answer.
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(timeout)
+    try:
+        conn.connect(socket_path)
+        stream = conn.makefile('rwb')
+        stream.write(json.dumps(request).encode('utf-8') + b'\n')
+        stream.flush()
+        answer = json.loads(stream.readline())
+        stream.close()
+    finally:
+        conn.close()
+    if 'error' in answer:
+        raise RuntimeError(answer['error'])
+    return answer['result']
+
+
+def main(cmdline=None):
+    parser = make_parser()
+    args = parser.parse_args(cmdline)
+
+    tree = Tree(args.root, args.packages)
+    try:
+        server = QueryServer(args.socket, tree)
+    except OSError as e:
+        print('ERROR:', e, file=sys.stderr)
+        return 1
+
+    if pyinotify is not None and not args.poll:
+        watcher = watch_inotify(tree)
+    else:
+        watcher = Poller(tree, args.poll or 5.0)
+        watcher.start()
+
+    # clean up the socket when killed too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+        server.server_close()
+
+def make_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('root', help='project root')
+    parser.add_argument('-p', '--packages', action='append',
+                        help='Packages or Sources file, may be given once '
+                             'per suite and architecture')
+    parser.add_argument('-s', '--socket', required=True,
+                        help='unix socket to answer queries on')
+    parser.add_argument('--poll', type=float, default=None,
+                        help='rescan every POLL seconds instead of '
+                             'using inotify')
+    return parser
+
+if __name__ == '__main__':
+    sys.exit(main())
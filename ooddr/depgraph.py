@@ -0,0 +1,254 @@
+"""Compact build dependency graph for repeated impact queries.
+
+DepGraph numbers the source packages and keeps the edges as CSR
+arrays, so walking the graph doesn't touch the package objects. The
+transitive closure can be precomputed as one python int per package
+used as a bitset, after which "what has to be rebuilt if X changes"
+is a few integer operations.
+
+  graph = DepGraph.from_networkx(find_build_order(root))
+  graph.compute_closure()
+  graph.rebuild_set(['kdelibs'])
+"""
+import numpy as np
+
+
+def _bits(bitset):
+    """Yield the positions of the set bits of an int
+    """
+    while bitset:
+        low = bitset & -bitset
+        yield low.bit_length() - 1
+        bitset ^= low
+
+
+class DepGraph(object):
+    """Build dependency graph with integer node ids
+
+    names lists the node names by id and ids maps them back. An edge
+    (a, b) means b build depends on a. indptr and indices are the CSR
+    arrays of the edges, the dependents of node i are
+    indices[indptr[i]:indptr[i + 1]], and rindptr and rindices the
+    same for the reversed edges.
+
+    closure is None until compute_closure is called, then bit j of
+    closure[i] is set if j depends on i directly or not. Added edges
+    and nodes keep it up to date, removing an edge drops it to be
+    computed again on the next query.
+    """
+    def __init__(self, names=(), edges=()):
+        self.names = []
+        self.ids = {}
+        self.edges = set()
+        self.closure = None
+        self._closure_wanted = False
+        self._csr = None
+        self._order = None
+        for name in names:
+            self.add_node(name)
+        for a, b in edges:
+            self.add_edge(a, b)
+
+    @classmethod
+    def from_networkx(cls, deps):
+        """Make a DepGraph of a graph from builddeps.build_package_graph
+        """
+        return cls(sorted(node.name for node in deps),
+                   ((a.name, b.name) for a, b in deps.edges()))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def add_node(self, name):
+        """Return the id of name, adding it if it is new
+        """
+        node = self.ids.get(name)
+        if node is None:
+            node = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self._edges_changed()
+            if self.closure is not None:
+                self.closure.append(0)
+        return node
+
+    def add_edge(self, a, b):
+        """Record that b build depends on a
+        """
+        a = self.add_node(a)
+        b = self.add_node(b)
+        if (a, b) in self.edges:
+            return
+        self.edges.add((a, b))
+        self._edges_changed()
+        if self.closure is not None:
+            # everything upstream of a, and a, now reaches b and what
+            # b reaches
+            reach = self.closure[b] | (1 << b)
+            bit = 1 << a
+            for node, bitset in enumerate(self.closure):
+                if node == a or bitset & bit:
+                    self.closure[node] = bitset | reach
+
+    def remove_edge(self, a, b):
+        edge = (self.ids[a], self.ids[b])
+        if edge in self.edges:
+            self.edges.remove(edge)
+            self._edges_changed()
+            if self.closure is not None:
+                self.closure = None
+                self._closure_wanted = True
+
+    def _edges_changed(self):
+        self._csr = None
+        self._order = None
+
+    def _get_csr(self):
+        if self._csr is None:
+            count = len(self.names)
+            if self.edges:
+                edges = np.array(sorted(self.edges), dtype=np.int32)
+            else:
+                edges = np.zeros((0, 2), dtype=np.int32)
+            self._csr = (_compress(edges[:, 0], edges[:, 1], count),
+                         _compress(edges[:, 1], edges[:, 0], count))
+        return self._csr
+
+    def _get_indptr(self):
+        return self._get_csr()[0][0]
+    indptr = property(_get_indptr)
+
+    def _get_indices(self):
+        return self._get_csr()[0][1]
+    indices = property(_get_indices)
+
+    def _get_rindptr(self):
+        return self._get_csr()[1][0]
+    rindptr = property(_get_rindptr)
+
+    def _get_rindices(self):
+        return self._get_csr()[1][1]
+    rindices = property(_get_rindices)
+
+    def dependents(self, name):
+        """Return the names that directly build depend on name
+        """
+        node = self.ids[name]
+        indptr, indices = self._get_csr()[0]
+        return [self.names[i]
+                for i in indices[indptr[node]:indptr[node + 1]].tolist()]
+
+    def dependencies(self, name):
+        """Return the names that name directly build depends on
+        """
+        node = self.ids[name]
+        rindptr, rindices = self._get_csr()[1]
+        return [self.names[i]
+                for i in rindices[rindptr[node]:rindptr[node + 1]].tolist()]
+
+    def topological_order(self):
+        """Return the node ids in an order where dependencies come first
+
+        Nodes on a cycle are put after everything else.
+        """
+        if self._order is not None:
+            return self._order
+        indptr, indices = self._get_csr()[0]
+        indptr = indptr.tolist()
+        indices = indices.tolist()
+        count = len(self.names)
+        incoming = [0] * count
+        for b in indices:
+            incoming[b] += 1
+        order = [node for node in range(count) if not incoming[node]]
+        for node in order:
+            for b in indices[indptr[node]:indptr[node + 1]]:
+                incoming[b] -= 1
+                if not incoming[b]:
+                    order.append(b)
+        if len(order) < count:
+            seen = set(order)
+            order.extend(node for node in range(count) if node not in seen)
+        self._order = order
+        return order
+
+    def compute_closure(self):
+        """Precompute which nodes each node reaches
+        """
+        indptr, indices = self._get_csr()[0]
+        indptr = indptr.tolist()
+        indices = indices.tolist()
+        count = len(self.names)
+        closure = [0] * count
+        order = self.topological_order()
+        # dependents first, so theirs are done when a node is reached.
+        # Cycles need a few passes until nothing changes.
+        changed = True
+        while changed:
+            changed = False
+            for node in reversed(order):
+                bitset = closure[node]
+                for b in indices[indptr[node]:indptr[node + 1]]:
+                    bitset |= closure[b] | (1 << b)
+                if bitset != closure[node]:
+                    closure[node] = bitset
+                    changed = True
+        self.closure = closure
+        self._closure_wanted = True
+        return closure
+
+    def _reach(self, node):
+        """Return the bitset of the nodes that depend on node
+        """
+        if self.closure is None and self._closure_wanted:
+            self.compute_closure()
+        if self.closure is not None:
+            return self.closure[node]
+
+        indptr, indices = self._get_csr()[0]
+        bitset = 0
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            for b in indices[indptr[current]:indptr[current + 1]].tolist():
+                if not bitset & (1 << b):
+                    bitset |= 1 << b
+                    stack.append(b)
+        return bitset
+
+    def rdeps(self, name):
+        """Return the names that build depend on name, directly or not
+        """
+        bitset = self._reach(self.ids[name])
+        return sorted(self.names[node] for node in _bits(bitset))
+
+    def is_upstream(self, a, b):
+        """Does b build depend on a, directly or not?
+        """
+        return bool(self._reach(self.ids[a]) & (1 << self.ids[b]))
+
+    def rebuild_set(self, changed):
+        """Return what to rebuild when the changed sources change
+
+        That is the changed sources and everything that build depends
+        on them, in an order where dependencies come first. Names that
+        aren't in the graph are ignored.
+        """
+        bitset = 0
+        for name in changed:
+            node = self.ids.get(name)
+            if node is not None:
+                bitset |= self._reach(node) | (1 << node)
+        return [self.names[node] for node in self.topological_order()
+                if bitset >> node & 1]
+
+
+def _compress(sources, targets, count):
+    """Return CSR indptr and indices arrays of the edges
+    """
+    order = np.argsort(sources, kind='stable')
+    indptr = np.zeros(count + 1, dtype=np.int32)
+    np.cumsum(np.bincount(sources, minlength=count), out=indptr[1:])
+    return indptr, targets[order]
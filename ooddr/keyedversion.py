@@ -0,0 +1,36 @@
+"""Debian versions that compare by their version_key.
+
+This is the only place the version module's pool needs python-debian,
+VersionPool imports it when it parses its first version so the modules
+that only need version_key stay light.
+"""
+from debian.debian_support import NativeVersion
+
+from .version import version_key
+
+
+class KeyedVersion(NativeVersion):
+    """A version that compares by its version_key
+
+    The key is computed once for each full version, so sorting and
+    comparing shared versions from intern_version is cheap.
+    """
+    _key = None
+    _key_version = None
+
+    def _get_key(self):
+        version = self.full_version
+        if self._key is None or version != self._key_version:
+            self._key = version_key(version)
+            self._key_version = version
+        return self._key
+    key = property(_get_key)
+
+    def _compare(self, other):
+        if other is None:
+            return 1
+        other_key = getattr(other, 'key', None)
+        if not isinstance(other_key, bytes):
+            other_key = version_key(other)
+        key = self.key
+        return (key > other_key) - (key < other_key)
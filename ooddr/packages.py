@@ -0,0 +1,316 @@
+"""Streaming readers for Debian Packages and Sources indices.
+
+Repository indices are large and we only need a few of their fields, so
+instead of building a Deb822 object per stanza these read just the
+requested fields straight into columns. PackagesIndex finds single
+stanzas of an uncompressed index without reading all of it.
+"""
+import bz2
+import gzip
+import lzma
+import mmap
+import os
+import pickle
+import sys
+
+from .scancache import file_stamp
+
+REPOSITORY_FIELDS = ('Package', 'Source', 'Version', 'Architecture',
+                     'Provides')
+
+# what a Sources stanza tells about the binaries built from it
+SOURCES_FIELDS = ('Package', 'Version', 'Binary')
+
+# fields whose values repeat across many stanzas, so they are interned
+# to share one string per distinct value
+INTERNED_FIELDS = frozenset(('Source', 'Version', 'Architecture'))
+
+def open_index(filename):
+    """Open a Packages or Sources file, decompressing it if needed
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', encoding='utf-8')
+    elif filename.endswith('.xz'):
+        return lzma.open(filename, 'rt', encoding='utf-8')
+    elif filename.endswith('.bz2'):
+        return bz2.open(filename, 'rt', encoding='utf-8')
+    return open(filename, 'r', encoding='utf-8')
+
+def index_list(package_files):
+    """Return a list of index names given one, several or None
+    """
+    if package_files is None:
+        return []
+    elif isinstance(package_files, str):
+        return [package_files]
+    return list(package_files)
+
+def is_sources_index(filename):
+    """Is filename a Sources index rather than a Packages one?
+    """
+    return os.path.basename(filename).split('_')[-1].startswith('Sources')
+
+def parse_index_spec(spec):
+    """Split an index argument into filename, suite and architecture
+
+    spec is a filename, optionally prefixed with "suite=". Otherwise
+    the suite and architecture are guessed from mirror paths like
+    dists/unstable/main/binary-amd64/Packages.xz and apt list names
+    like ..._dists_unstable_main_binary-amd64_Packages. The
+    architecture of a Sources index is source. Returns None for what
+    can't be told.
+    """
+    suite = None
+    prefix, sep, filename = spec.partition('=')
+    if sep and prefix and '/' not in prefix and not os.path.exists(spec):
+        suite, spec = prefix, filename
+    arch = None
+    directory, basename = os.path.split(spec)
+    parts = directory.split('/') + basename.split('_')
+    for i, part in enumerate(parts[:-1]):
+        if part == 'dists' and suite is None:
+            suite = parts[i + 1]
+        elif part.startswith('binary-'):
+            arch = part[len('binary-'):]
+    if is_sources_index(spec):
+        arch = 'source'
+    return spec, suite, arch
+
+def split_source_field(source):
+    """Split a Packages Source field like "foo (1.2-1)" into name and version
+
+    The version is None if the binary has the same version as its source.
+    """
+    name, sep, version = source.partition(' ')
+    version = version.strip().strip('()').strip()
+    return name, version or None
+
+def read_columns(stream, fields=REPOSITORY_FIELDS):
+    """Read fields from every stanza of an index into columns.
+
+    Returns a dictionary mapping each field name to a list with one
+    value per stanza, None if the stanza didn't have that field.
+    Field names are matched case insensitively and stanzas without
+    any of the fields are skipped. If fields is None every field found
+    in the index is returned.
+    """
+    columns = {}
+    names = {}
+    if fields is not None:
+        for f in fields:
+            columns[f] = []
+            names[f.lower()] = f
+    rows = 0
+    row = {}
+    current = None
+    for line in stream:
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                row[current] += '\n' + line.rstrip('\n')
+            continue
+
+        line = line.rstrip('\n')
+        if not line.strip():
+            if row:
+                rows = _append_row(columns, row, rows)
+                row = {}
+            current = None
+            continue
+
+        key, sep, value = line.partition(':')
+        if not sep:
+            current = None
+            continue
+        lower_key = key.lower()
+        current = names.get(lower_key)
+        if current is None and fields is None:
+            current = names[lower_key] = key
+            columns[key] = [None] * rows
+        if current is not None:
+            value = value.strip()
+            if current in INTERNED_FIELDS:
+                value = sys.intern(value)
+            row[current] = value
+
+    if row:
+        _append_row(columns, row, rows)
+    return columns
+
+def _append_row(columns, row, rows):
+    for name, column in columns.items():
+        column.append(row.get(name))
+    return rows + 1
+
+def iter_stanzas(stream, fields=REPOSITORY_FIELDS):
+    """Yield a dictionary of the requested fields for every stanza
+    """
+    names = {f.lower(): f for f in fields}
+    row = {}
+    current = None
+    for line in stream:
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                row[current] += '\n' + line.rstrip('\n')
+            continue
+
+        if not line.strip():
+            if row:
+                yield row
+                row = {}
+            current = None
+            continue
+
+        key, sep, value = line.partition(':')
+        current = names.get(key.lower()) if sep else None
+        if current is not None:
+            value = value.strip()
+            if current in INTERNED_FIELDS:
+                value = sys.intern(value)
+            row[current] = value
+
+    if row:
+        yield row
+
+# change this whenever the layout of the offset index changes
+OFFSETS_FORMAT = 1
+
+class PackagesIndex(object):
+    """Byte offsets of the stanzas of an uncompressed Packages file
+
+    packages, sources and provides map binary, source and virtual
+    package names to the offsets of the stanzas that have them. The
+    offsets are kept in a sidecar file next to the Packages file and
+    are rebuilt when its stamp changes. Lookups read just the stanzas
+    they need from an mmap of the file.
+    """
+    def __init__(self, filename, index_filename=None):
+        self.filename = filename
+        self.index_filename = index_filename or filename + '.offsets'
+        self.packages = {}
+        self.sources = {}
+        self.provides = {}
+        self._file = None
+        self._map = None
+        if not self.load():
+            self.build()
+            self.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            if self._map:
+                self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+    def load(self):
+        """Load the sidecar index, returns False if it is missing or stale
+        """
+        try:
+            with open(self.index_filename, 'rb') as stream:
+                index_format, stamp, tables = pickle.load(stream)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return False
+        if index_format != OFFSETS_FORMAT or \
+           stamp != file_stamp(self.filename):
+            return False
+        self.packages, self.sources, self.provides = tables
+        return True
+
+    def save(self):
+        tables = (self.packages, self.sources, self.provides)
+        temp_filename = self.index_filename + '.tmp'
+        try:
+            with open(temp_filename, 'wb') as stream:
+                pickle.dump((OFFSETS_FORMAT, file_stamp(self.filename),
+                             tables), stream, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_filename, self.index_filename)
+        except OSError as e:
+            # the index still works, it just has to be built next time
+            print('WARNING: not saving offset index', self.index_filename, e,
+                  file=sys.stderr)
+
+    def build(self):
+        """Find the offset and names of every stanza
+        """
+        packages = {}
+        sources = {}
+        provides = {}
+        offset = 0
+        start = None
+        names = {}
+        with open(self.filename, 'rb') as stream:
+            for line in stream:
+                if not line.strip():
+                    if start is not None:
+                        _add_offsets(packages, sources, provides, names,
+                                     start)
+                    start = None
+                    names = {}
+                elif line[:1] not in (b' ', b'\t'):
+                    if start is None:
+                        start = offset
+                    key, sep, value = line.partition(b':')
+                    key = key.lower()
+                    if key in (b'package', b'source', b'provides'):
+                        names[key] = value.strip().decode('utf-8')
+                offset += len(line)
+        if start is not None:
+            _add_offsets(packages, sources, provides, names, start)
+        self.packages = packages
+        self.sources = sources
+        self.provides = provides
+
+    def read(self, offset, fields=REPOSITORY_FIELDS):
+        """Return the requested fields of the stanza at offset
+        """
+        if self._file is None:
+            self._file = open(self.filename, 'rb')
+            if os.fstat(self._file.fileno()).st_size:
+                self._map = mmap.mmap(self._file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            else:
+                # an empty file can't be mapped, and has no stanzas
+                self._map = b''
+        end = self._map.find(b'\n\n', offset)
+        if end == -1:
+            end = len(self._map)
+        text = self._map[offset:end].decode('utf-8')
+        for stanza in iter_stanzas(text.splitlines(True), fields):
+            return stanza
+        return {}
+
+    def lookup(self, names, fields=REPOSITORY_FIELDS, tables=None):
+        """Yield the stanzas of the binary, source or virtual packages names
+
+        tables limits the lookup to some of packages, sources and
+        provides. Each stanza is read once, in file order.
+        """
+        if tables is None:
+            tables = (self.packages, self.sources, self.provides)
+        offsets = set()
+        for name in names:
+            for table in tables:
+                offsets.update(table.get(name, ()))
+        for offset in sorted(offsets):
+            yield self.read(offset, fields)
+
+def _add_offsets(packages, sources, provides, names, start):
+    package = names.get(b'package')
+    if package is None:
+        return
+    packages.setdefault(package, []).append(start)
+    source, version = split_source_field(names.get(b'source') or package)
+    sources.setdefault(source, []).append(start)
+    for virtual in names.get(b'provides', '').split(','):
+        virtual = virtual.split('(')[0].strip()
+        if virtual:
+            provides.setdefault(virtual, []).append(start)
+
+def is_compressed(filename):
+    return filename.endswith(('.gz', '.xz', '.bz2'))
@@ -1,45 +1,68 @@
 import pandas as pd
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
-from .builddeps import Dsc, Control, Packages
-from .watch import Watch
+from .builddeps import Dsc, Control, BUILD_DEPENDS_FIELDS
+from .packages import REPOSITORY_FIELDS, open_index, read_columns, \
+    index_list, parse_index_spec
+from .watch import Watch, match_filelist
+from .scancache import cached_map
+from .checksums import hash_files, check_file, size_matches
+from .stats import timed, count
+from .core import VCS_DIRS, scan_dir, walk_debian_files
+from .version import version_keys, version_string
 from .changelog import OrderedChangelog, ChangelogParseError
 
-VCS_DIRS = ('.git', '.hg', '.bzr', '.svn')
-
-def find_debian_files(root):
+@timed('find_debian_files')
+def find_debian_files(root, jobs=None):
     """Scan through a directory tree looking for unpacked debian sources
+
+    If jobs is greater than one the top level directories of root are
+    walked in parallel by a pool of processes.
     """
-    debian_files = []
-    for pathname, dirnames, filenames in os.walk(root, topdown=True):
-        # don't decend into vcs dirs
-        to_delete = set()
-        for i, d in enumerate(dirnames):
-            if d in 'debian':
-                to_delete.add(i)
-                changelog = os.path.join(pathname, 'debian', 'changelog')
-                control = os.path.join(pathname, 'debian', 'control')
-                if os.path.exists(changelog) and os.path.exists(control):
-                    debian_files.append(('package', pathname))
-                    to_delete = set(range(len(dirnames)))
-                    # deleting here doesn't work, dirnames
-                    # seems protected by the for loop
-            elif d in VCS_DIRS:
-                to_delete.add(i)
-
-        for i in sorted(to_delete)[::-1]:
-            del dirnames[i]
-
-        for f in filenames:
-            if f.endswith('.dsc'):
-                debian_files.append(('dsc', os.path.join(pathname, f)))
+    if jobs is not None and jobs > 1:
+        pathname, dirnames, filenames = next(os.walk(root, topdown=True))
+        debian_files = scan_dir(pathname, dirnames, filenames)
+        subdirs = [os.path.join(pathname, d) for d in dirnames]
+        for found in _map(walk_debian_files, subdirs, jobs):
+            debian_files.extend(found)
+    else:
+        debian_files = walk_debian_files(root)
 
     return pd.DataFrame(debian_files,
                         columns=['type', 'filename'])
 
-def build_package_tables(debian_files):
+def _map(function, items, jobs=None):
+    """Apply function to every item, using a process pool if jobs > 1
+
+    Results are returned in the same order as items.
+    """
+    items = list(items)
+    if jobs is None or jobs <= 1 or len(items) < 2:
+        return [function(x) for x in items]
+
+    chunksize = max(1, len(items) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(function, items, chunksize=chunksize))
+
+def _mapper(jobs):
+    return lambda function, items: _map(function, items, jobs)
+
+# so the tables of a tree without packages still have them
+SOURCE_COLUMNS = ['Source', 'Version', 'Watch']
+NEEDS_COLUMNS = ['name', 'archqual', 'version', 'arch', 'restrictions',
+                 'Group', 'Source']
+PROVIDES_COLUMNS = ['Package', 'Source']
+
+@timed('build_package_tables')
+def build_package_tables(debian_files, jobs=None, cache=None):
     """Reads all the debian package directories in the file list
 
+    If jobs is greater than one the packages are parsed in parallel
+    by a pool of processes. If a ScanCache is passed only packages
+    whose debian files changed since it was saved are parsed.
+
     Returns a tuple of data frames for all the packages
       source   - information about the source packages
       needs    - the build-depends for the source packages
@@ -48,40 +71,74 @@ def build_package_tables(debian_files):
     sources = []
     needs = []
     binaries = []
-    for pathname in debian_files[debian_files.type == 'package'].filename:
-        s, n, b = read_debian_dir(pathname)
+    pathnames = debian_files[debian_files.type == 'package'].filename
+    records = cached_map(cache, 'package', read_debian_records, pathnames,
+                         debian_dir_files, _mapper(jobs))
+    for s, n, b in records:
         sources.append(s)
-        needs.append(n)
-        binaries.append(b)
+        needs.extend(n)
+        binaries.extend(b)
 
-    sources = pd.DataFrame(sources, columns=sources[0].index)
-    needs = pd.concat(needs)
-    binaries = pd.concat(binaries)
+    sources = pd.DataFrame(sources) if sources else \
+        pd.DataFrame(columns=SOURCE_COLUMNS)
+    needs = pd.DataFrame(needs) if needs else \
+        pd.DataFrame(columns=NEEDS_COLUMNS)
+    binaries = pd.DataFrame(binaries) if binaries else \
+        pd.DataFrame(columns=PROVIDES_COLUMNS)
     return sources, needs, binaries
 
-def read_debian_dir(package_dir):
+def debian_dir_files(package_dir):
+    """Return the files in a debian directory that we read
+    """
+    debian_dir = os.path.join(package_dir, 'debian')
+    return [os.path.join(debian_dir, 'control'),
+            os.path.join(debian_dir, 'changelog'),
+            os.path.join(debian_dir, 'watch')]
+
+def read_debian_dir(package_dir, cache=None):
     """Read one packages debian control files.
 
     Returns a tuple
       source   - information about the source package
-      needs    - the build-depends for the source package
+      needs    - the build-depends for the source package, one row
+                 per alternative with Group numbering the relations
       provides - what binary packages it builds
     Provides does have the source package name attached
     """
+    if cache is not None:
+        source, needs, provides = cache.fetch(
+            'package', package_dir, debian_dir_files(package_dir),
+            read_debian_records)
+    else:
+        source, needs, provides = read_debian_records(package_dir)
+
+    source = pd.Series(source)
+    needs = pd.DataFrame(needs)
+    needs['Source'] = source['Source']
+    provides = pd.DataFrame(provides)
+    provides['Source'] = source['Source']
+    return source, needs, provides
+
+def read_debian_records(package_dir):
+    """Read one packages debian control files into plain records.
+
+    Returns the same tuple as read_debian_dir, but as a dictionary
+    for the source and lists of dictionaries for needs and provides,
+    which are cheap to cache and to send between processes.
+    """
     debian_dir = os.path.join(package_dir, 'debian')
     if not os.path.exists(debian_dir):
         raise IOError(
             'Expected a debian directory in {}'.format(package_dir))
 
-    control_filename = os.path.join(debian_dir, 'control')
-    changelog_filename = os.path.join(debian_dir, 'changelog')
-    watch_filename = os.path.join(debian_dir, 'watch')
+    control_filename, changelog_filename, watch_filename = \
+        debian_dir_files(package_dir)
 
     package_version = None
     with open(changelog_filename, 'r') as stream:
         log = OrderedChangelog()
         try:
-                log.parse_changelog(stream)
+                log.parse_changelog_head(stream)
                 package_version = log
         except ChangelogParseError as e:
                 # really log
@@ -96,30 +153,59 @@ def read_debian_dir(package_dir):
     control = Control()
     with open(control_filename, 'r') as stream:
         p = list(control.iter_paragraphs(stream))
-        source = {k: p[0][k] for k in p[0] if k != 'Build-Depends'}
+        source = {k: p[0][k] for k in p[0]
+                  if k.lower() not in BUILD_DEPENDS_FIELDS}
         source['Version'] =  package_version
         source['Watch'] = watch
-        source = pd.Series(source)
-        needs = [ x[0] for x in p[0].relations['build-depends']]
-        needs = pd.DataFrame(needs)
-        needs['Source'] = source['Source']
-        provides = pd.DataFrame([dict(x) for x in p[1:]])
-        provides['Source'] = source['Source']
+        needs = []
+        relations = [alternatives for field in BUILD_DEPENDS_FIELDS
+                     for alternatives in p[0].relations[field]]
+        for group, alternatives in enumerate(relations):
+            for x in alternatives:
+                needs.append(dict(x, Group=group))
+        provides = [dict(x) for x in p[1:]]
+        for record in needs + provides:
+            record['Source'] = source['Source']
         return source, needs, provides
 
-def build_dsc_tables(debian_files):
+# so the tables of a tree without dsc files still have them
+DSC_COLUMNS = ['Source', 'Version']
+DSC_FILE_COLUMNS = ['name', 'size', 'md5sum', 'sha256', 'Source', 'Directory']
+
+@timed('build_dsc_tables')
+def build_dsc_tables(debian_files, jobs=None, cache=None):
+    """Read the dsc files in the file list
+
+    Returns a tuple of data frames of the dsc fields and of the files
+    the dscs list.
+    """
     dscs = []
     files = []
-    for pathname in debian_files[debian_files.type == 'dsc'].filename:
-        d, f = read_dsc(pathname)
+    pathnames = debian_files[debian_files.type == 'dsc'].filename
+    records = cached_map(cache, 'dsc', read_dsc_records, pathnames,
+                         lambda x: [x], _mapper(jobs))
+    for d, f in records:
         dscs.append(d)
-        files.append(f)
+        files.extend(f)
 
-    return pd.DataFrame(dscs), pd.concat(files)
+    if not dscs:
+        return (pd.DataFrame(columns=DSC_COLUMNS),
+                pd.DataFrame(columns=DSC_FILE_COLUMNS))
+    return pd.DataFrame(dscs), pd.DataFrame(files)
 
-def read_dsc(filename):
+def read_dsc(filename, cache=None):
     """Read a dsc file and return package and file metadata
     """
+    if cache is not None:
+        dsc, files = cache.fetch('dsc', filename, [filename],
+                                 read_dsc_records)
+    else:
+        dsc, files = read_dsc_records(filename)
+    return pd.Series(dsc), pd.DataFrame(files)
+
+def read_dsc_records(filename):
+    """Read a dsc file into a dictionary and a list of file records
+    """
     with open(filename) as stream:
         debdsc = Dsc(stream)
         dsc = {}
@@ -131,23 +217,264 @@ def read_dsc(filename):
                     file_name = file_rec['name']
                     files.setdefault(file_name, {}).update(file_rec)
                     files[file_name]['Source'] = debdsc['Source']
+                    files[file_name]['Directory'] = os.path.dirname(filename)
             else:
                 dsc[k] = value
-    return pd.Series(dsc), pd.DataFrame(list(files.values()))
+    return dsc, list(files.values())
+
+@timed('verify_dsc_files')
+def verify_dsc_files(files, tarballs, jobs=4, cache=None):
+    """Check the files listed in dsc files against the ones on disk
+
+    files is the second table from build_dsc_tables and tarballs a
+    TarballIndex of the tree. Files are looked for next to their dsc
+    first. Only files of the right size are hashed, by jobs threads.
+
+    Returns files with path and Status columns added, see
+    checksums.check_file for the status values.
+    """
+    paths = [tarballs.find(name, directory)
+             for name, directory in zip(files.name, files.Directory)]
+    sha256 = files['sha256'] if 'sha256' in files else [None] * len(files)
+    to_hash = {path for path, size, digest in zip(paths, files['size'], sha256)
+               if isinstance(digest, str) and path is not None and
+               size_matches(path, size)}
+    digests = hash_files(sorted(to_hash), jobs, cache)
+    status = [check_file(path, size, digest, digests)
+              for path, size, digest in zip(paths, files['size'], sha256)]
+    return files.assign(path=paths, Status=status)
+
+@timed('build_repository_table')
+def build_repository_table(package_files, fields=REPOSITORY_FIELDS, jobs=None):
+    """Read the fields we need from Packages and Sources files into a data frame
+
+    package_files is one index or a list of them, given as accepted
+    by packages.parse_index_spec, and each may be compressed with
+    gzip, xz or bzip2. Several indices are read in parallel by jobs
+    processes, one per index up to the number of cpus by default.
+    Pass fields=None to keep every field.
+
+    Every row gets the Suite and Arch of the index it came from, Arch
+    falls back to the Architecture field if the index name doesn't
+    tell.
+    """
+    specs = index_list(package_files)
+    if jobs is None:
+        jobs = min(len(specs), os.cpu_count() or 1)
+    tables = _map(partial(read_repository_index, fields=fields), specs, jobs)
+    if len(tables) == 1:
+        repository = tables[0]
+    else:
+        repository = pd.concat(tables, ignore_index=True)
+    for spec in specs:
+        count('files read')
+        count('bytes read', os.path.getsize(parse_index_spec(spec)[0]))
+    count('stanzas', len(repository))
+    return repository
 
-def build_repository_table(package_file):
-    with open(package_file) as stream:
-        repository = Packages().iter_paragraphs(stream)
+def read_repository_index(spec, fields=REPOSITORY_FIELDS):
+    """Read one index for build_repository_table
+    """
+    filename, suite, arch = parse_index_spec(spec)
+    with open_index(filename) as stream:
+        repository = pd.DataFrame(read_columns(stream, fields))
+    if arch is None and 'Architecture' in repository:
+        arch = repository.Architecture
+    return repository.assign(Suite=suite, Arch=arch)
+
+@timed('build_source_versions')
+def build_source_versions(repository, names=None):
+    """Reduce a repository table to the newest version of each source
 
-        return pd.DataFrame([dict(x) for x in repository])
+    Binaries without a Source field come from the source of the same
+    name, and the version in a "Source: foo (version)" field, like
+    binNMUs have, is used instead of the binary version. If names is
+    given only those sources are kept.
+
+    Returns a data frame with one row per Source and its newest
+    Version anywhere in the repository, with the Suite it is in if the
+    repository has suites.
+    """
+    if 'Source' in repository:
+        sources = repository.Source.where(repository.Source.notna(),
+                                          repository.Package)
+    else:
+        sources = repository.Package
+    versions = repository.Version
+    with_version = sources.str.contains('(', regex=False).fillna(False)
+    if with_version.any():
+        parts = sources[with_version].str.extract(
+            r'^\s*(\S+)\s*\(\s*([^)\s]+)\s*\)')
+        sources = sources.mask(with_version, parts[0])
+        versions = versions.mask(with_version, parts[1])
+    view = pd.DataFrame({'Source': sources.values, 'Version': versions.values})
+    if 'Suite' in repository:
+        view['Suite'] = repository.Suite.values
+    if names is not None:
+        view = view[view.Source.isin(names)]
+    view = view.iloc[version_keys(view.Version).argsort(kind='stable')]
+    view = view.drop_duplicates('Source', keep='last')
+    return view.sort_values('Source').reset_index(drop=True)
 
+@timed('find_newer_source')
 def find_newer_source(source, repository):
+    """Return the sources that are newer than the repository
+
+    repository is a table from build_repository_table, or one from
+    build_source_versions, which is made from it otherwise. The source
+    versions are in Version_src and the repository ones in
+    Version_repo, along with the Suite of the repository version if
+    there are suites.
+    """
+    if 'Package' in repository:
+        repository = build_source_versions(repository, source.Source)
+    columns = ['Source', 'Version']
+    if 'Suite' in repository:
+        columns.append('Suite')
     sr = pd.merge(source,
-                  repository,
+                  repository[columns],
                   on=['Source'],
                   suffixes=['_src', '_repo'],
+                  validate='many_to_one',
         )
-    return sr[sr.Version_src > sr.Version_repo]
+    newer = version_keys(sr.Version_src) > version_keys(sr.Version_repo)
+    return sr[newer]
+
+# the deprecated < and > mean <= and >=
+_RELATION_TESTS = {
+    '>=': lambda have, want: have >= want,
+    '>': lambda have, want: have >= want,
+    '<=': lambda have, want: have <= want,
+    '<': lambda have, want: have <= want,
+    '=': lambda have, want: have == want,
+    '>>': lambda have, want: have > want,
+    '<<': lambda have, want: have < want,
+}
+
+@timed('build_candidates')
+def build_candidates(repository, source=None, provides=None):
+    """Collect the binary and virtual packages that could satisfy a need
+
+    Combines the repository binaries, the binaries built by local
+    source packages at the version in their changelog and the
+    Provides fields of both.
+
+    Returns a data frame of Package, Version and Origin. Version is
+    None for unversioned virtual packages.
+    """
+    if 'Arch' in repository:
+        # the packages of a Sources index are source packages
+        repository = repository[repository.Arch != 'source']
+    candidates = [repository[['Package', 'Version']].assign(Origin='repository')]
+    if 'Provides' in repository:
+        candidates.append(
+            _split_provides(repository[['Provides', 'Version']], 'repository'))
+
+    if source is not None and provides is not None:
+        local = pd.merge(provides, source[['Source', 'Version']], on='Source')
+        local['Version'] = [version_string(v) for v in local.Version]
+        candidates.append(local[['Package', 'Version']].assign(Origin='local'))
+        if 'Provides' in local:
+            candidates.append(
+                _split_provides(local[['Provides', 'Version']], 'local'))
+
+    return pd.concat(candidates, ignore_index=True)
+
+def _split_provides(provides, origin):
+    """Turn a Provides column into one row per virtual package
+    """
+    virtuals = provides.dropna(subset=['Provides'])
+    virtuals = virtuals.assign(Provides=virtuals.Provides.str.split(','))
+    virtuals = virtuals.explode('Provides')
+    parts = virtuals.Provides.str.extract(
+        r'^\s*([^\s(]+)\s*(?:\(\s*=\s*([^)\s]+)\s*\))?')
+    return pd.DataFrame({'Package': parts[0].values,
+                         'Version': parts[1].values,
+                         'Origin': origin})
 
+@timed('find_unsatisfied')
+def find_unsatisfied(needs, candidates, source=None):
+    """Check every build dependency against the candidate packages
+
+    needs is the table from build_package_tables and candidates the
+    one from build_candidates. The check is done with a join and
+    vectorized version comparisons. Relations restricted to some
+    architectures or build profiles depend on what is being built, so
+    they aren't checked.
+
+    Returns a data frame with one row per source package, of source
+    if it is given so sources without build dependencies are listed
+    too. Buildable says whether every Build-Depends relation can be
+    satisfied and Unsatisfied lists the relations that can't.
+    """
+    if source is not None:
+        names = source.Source.unique()
+    elif len(needs):
+        names = needs.Source.unique()
+    else:
+        names = []
+    report = pd.DataFrame({'Source': names})
+
+    relations = needs
+    for column in ('arch', 'restrictions'):
+        if column in relations:
+            relations = relations[relations[column].isna()]
+    unmet = {}
+    if len(relations):
+        unmet = _unmet_relations(relations, candidates)
+
+    report['Unsatisfied'] = [unmet.get(name, []) for name in report.Source]
+    report['Buildable'] = [not x for x in report.Unsatisfied]
+    return report
+
+def _unmet_relations(needs, candidates):
+    """Return a series of source name to its unsatisfied relations
+    """
+    relations = needs[['Source', 'Group', 'name', 'version']]
+    relations = relations.assign(
+        Operator=relations.version.str.get(0),
+        Required=relations.version.str.get(1))
+    joined = pd.merge(relations, candidates,
+                      left_on='name', right_on='Package', how='left')
+
+    have = version_keys(joined.Version.where(joined.Version.notna(), None))
+    want = version_keys(joined.Required.where(joined.Required.notna(), None))
+    found = joined.Package.notna().values
+    unversioned = joined.Operator.isna().values
+    satisfied = found & unversioned
+    has_version = found & joined.Version.notna().values
+    for operator, test in _RELATION_TESTS.items():
+        rows = has_version & (joined.Operator == operator).values
+        satisfied |= rows & test(have, want)
+    joined['Satisfied'] = satisfied
+
+    groups = joined.groupby(['Source', 'Group'], sort=False).Satisfied.any()
+    unmet = groups[~groups].reset_index()[['Source', 'Group']]
+    unmet = pd.merge(unmet, relations, on=['Source', 'Group'])
+    unmet['Relation'] = unmet.name + [
+        ' ({} {})'.format(*v) if isinstance(v, tuple) else ''
+        for v in unmet.version]
+    return unmet.groupby(['Source', 'Group'], sort=False).Relation.agg(
+        ' | '.join).groupby(level=0).agg(list)
+
+@timed('add_local_versions')
 def add_local_versions(source, downloads):
+    """Find the newest upstream tarball in downloads for each source
+
+    The download directory is listed once and matched against the
+    watch file patterns of every source package.
+
+    Returns a data frame with Source, local_version and path columns
+    """
+    patterns = {name: watch.unresolved_filename
+                for name, watch in zip(source.Source, source.Watch)
+                if watch is not None}
     files = os.listdir(downloads)
+    newest = {}
+    for name, version, filename in match_filelist(patterns, files):
+        if name not in newest or version > newest[name][0]:
+            newest[name] = (version, filename)
+
+    local = [(name, version, os.path.join(downloads, filename))
+             for name, (version, filename) in sorted(newest.items())]
+    return pd.DataFrame(local, columns=['Source', 'local_version', 'path'])
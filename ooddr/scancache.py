@@ -0,0 +1,124 @@
+"""Persistent cache of records parsed from debian metadata files.
+"""
+import os
+import pickle
+import sys
+
+from . import stats
+
+# Change this whenever the records that are cached change, so old
+# caches are ignored instead of returning records in the old format.
+CACHE_FORMAT = 5
+
+
+def file_stamp(filename):
+    """Return something that changes when filename is modified.
+
+    The stamp is the (mtime, size, inode) of the file, or None if it
+    doesn't exist.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class ScanCache(object):
+    """Remember records read from files between runs.
+
+    Entries are keyed by a kind and a path and store the stamps of the
+    files the records were read from. An entry is only reused if none of
+    those files changed. Entries whose path was deleted are dropped
+    when the cache is saved, so they don't accumulate.
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if filename is not None and os.path.exists(filename):
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as stream:
+                cache_format, entries = pickle.load(stream)
+        except Exception as e:
+            # a stale or corrupt cache just means a full scan
+            print('WARNING: ignoring scan cache', self.filename, e,
+                  file=sys.stderr)
+            cache_format, entries = None, {}
+        self.entries = entries if cache_format == CACHE_FORMAT else {}
+
+    def save(self):
+        if self.filename is None:
+            return
+
+        entries = {k: v for k, v in self.entries.items()
+                   if os.path.exists(k[1])}
+        cache_dir = os.path.dirname(self.filename)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'wb') as stream:
+            pickle.dump((CACHE_FORMAT, entries), stream,
+                        pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_filename, self.filename)
+        self.entries = entries
+
+    def get(self, kind, path, filenames):
+        """Return the records stored for path or None if they are stale.
+
+        filenames are the files the records were read from.
+        """
+        key = (kind, path)
+        entry = self.entries.get(key)
+        if entry is not None:
+            stamps, records = entry
+            if stamps == tuple(file_stamp(f) for f in filenames):
+                self.hits += 1
+                stats.count('cache hits')
+                return records
+        self.misses += 1
+        stats.count('cache misses')
+        return None
+
+    def put(self, kind, path, filenames, records):
+        key = (kind, path)
+        stamps = tuple(file_stamp(f) for f in filenames)
+        self.entries[key] = (stamps, records)
+
+    def fetch(self, kind, path, filenames, reader):
+        """Return the records for path, calling reader(path) if needed
+        """
+        records = self.get(kind, path, filenames)
+        if records is None:
+            records = reader(path)
+            self.put(kind, path, filenames, records)
+        return records
+
+
+def cached_map(cache, kind, reader, paths, dependencies, mapper=map):
+    """Read records for every path, reusing unchanged ones from cache.
+
+    dependencies(path) returns the files the records for path are read
+    from, and mapper is used to call reader on the paths that missed,
+    so they can be parsed in parallel.
+    """
+    paths = list(paths)
+    collecting = stats.active()
+    if collecting is not None:
+        mapper = collecting.item_mapper(kind, mapper, dependencies)
+    if cache is None:
+        return list(mapper(reader, paths))
+
+    results = [cache.get(kind, p, dependencies(p)) for p in paths]
+    missing = [i for i, r in enumerate(results) if r is None]
+    for i, records in zip(missing, mapper(reader, [paths[i] for i in missing])):
+        cache.put(kind, paths[i], dependencies(paths[i]), records)
+        results[i] = records
+    return results
@@ -0,0 +1,203 @@
+"""Optional timing and counters for the scanning pipelines.
+
+Nothing is measured unless a Stats object was enabled, so the checks
+sprinkled through pdood and builddeps only cost a global lookup.
+
+  stats = enable()
+  find_build_order(root)
+  disable()
+  print(stats.format())
+"""
+import functools
+import heapq
+import json
+import os
+import time
+from contextlib import contextmanager
+
+_active = None
+
+
+class Stats(object):
+    """Collect per stage times, counters and the slowest items.
+
+    stages maps a stage name to its number of calls, wall and cpu
+    seconds, counters maps a name to a number and slowest keeps the
+    slowest items, like packages to parse, as (seconds, kind, name).
+    """
+    def __init__(self, slowest=10):
+        self.stages = {}
+        self.counters = {}
+        self.slowest = []
+        self.slowest_count = slowest
+        self.hooks = []
+
+    def add_hook(self, hook):
+        """Call hook(event, name, value) whenever something is measured
+
+        event is 'stage' with a dictionary of calls, seconds and
+        cpu_seconds for the value, or the kind of an item like
+        'package' with the seconds it took.
+        """
+        self.hooks.append(hook)
+
+    def _notify(self, event, name, value):
+        for hook in self.hooks:
+            hook(event, name, value)
+
+    @contextmanager
+    def stage(self, name):
+        """Time the body of a with statement as a stage
+        """
+        record = self.stages.setdefault(
+            name, {'calls': 0, 'seconds': 0.0, 'cpu_seconds': 0.0})
+        start = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['calls'] += 1
+            record['seconds'] += time.perf_counter() - start
+            record['cpu_seconds'] += time.process_time() - cpu
+            self._notify('stage', name, record)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def count_files(self, filenames):
+        """Count files that were read and their size in bytes
+        """
+        for filename in filenames:
+            try:
+                size = os.path.getsize(filename)
+            except OSError:
+                continue
+            self.count('files read')
+            self.count('bytes read', size)
+
+    def item(self, kind, name, seconds):
+        """Record how long one item took
+        """
+        entry = (seconds, kind, name)
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+        self._notify(kind, name, seconds)
+
+    def item_mapper(self, kind, mapper=map, dependencies=None):
+        """Wrap a mapper so every call is timed as an item
+
+        The calls may run in other processes, they report their time
+        with the result. If dependencies is given it returns the files
+        read for an item and those are counted.
+        """
+        def timed_mapper(function, items):
+            items = list(items)
+            results = []
+            timed = mapper(TimedCall(function), items)
+            for item, (seconds, result) in zip(items, timed):
+                self.item(kind, item, seconds)
+                if dependencies is not None:
+                    self.count_files(dependencies(item))
+                results.append(result)
+            return results
+        return timed_mapper
+
+    def as_dict(self):
+        slowest = [{'kind': kind, 'name': name, 'seconds': seconds}
+                   for seconds, kind, name in sorted(self.slowest,
+                                                     reverse=True)]
+        return {'stages': self.stages,
+                'counters': self.counters,
+                'slowest': slowest}
+
+    def format(self, style='text'):
+        """Return the statistics as text or json
+        """
+        if style == 'json':
+            return json.dumps(self.as_dict(), indent=1)
+
+        lines = ['{:<24} {:>6} {:>10} {:>10}'.format(
+            'stage', 'calls', 'seconds', 'cpu')]
+        for name, record in self.stages.items():
+            lines.append('{:<24} {:>6} {:>10.3f} {:>10.3f}'.format(
+                name, record['calls'], record['seconds'],
+                record['cpu_seconds']))
+        if self.counters:
+            lines.append('')
+            for name in sorted(self.counters):
+                lines.append('{:<24} {:>10}'.format(name, self.counters[name]))
+        if self.slowest:
+            lines.append('')
+            lines.append('slowest')
+            for seconds, kind, name in sorted(self.slowest, reverse=True):
+                lines.append('{:>10.3f} {} {}'.format(seconds, kind, name))
+        return '\n'.join(lines)
+
+
+class TimedCall(object):
+    """Call function and return (seconds, result)
+
+    A class instead of a closure so it can be sent to a process pool.
+    """
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = self.function(*args, **kwargs)
+        return time.perf_counter() - start, result
+
+
+def enable(stats=None):
+    """Start collecting into stats, or a new Stats, and return it
+    """
+    global _active
+    if stats is None:
+        stats = Stats()
+    _active = stats
+    return stats
+
+def disable():
+    global _active
+    _active = None
+
+def active():
+    """Return the Stats being collected into or None
+    """
+    return _active
+
+def timed(name):
+    """Decorator timing every call of a function as the stage name
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stats = _active
+            if stats is None:
+                return function(*args, **kwargs)
+            with stats.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, n=1):
+    stats = _active
+    if stats is not None:
+        stats.count(name, n)
+
+@contextmanager
+def profile(filename):
+    """Run the body of a with statement under cProfile
+
+    The profile is written to filename for pstats or snakeviz.
+    """
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
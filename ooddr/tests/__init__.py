@@ -5,6 +5,17 @@ def test_suite():
     module_names = [
         '.test_watch',
         '.test_changelog',
+        '.test_scancache',
+        '.test_packages',
+        '.test_version',
+        '.test_builddeps',
+        '.test_pdood',
+        '.test_core',
+        '.test_benchmark',
+        '.test_stats',
+        '.test_daemon',
+        '.test_checksums',
+        '.test_depgraph',
     ]
     suites = []
     for m in module_names:
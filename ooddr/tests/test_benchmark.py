@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import benchmark
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        self.root = os.path.join(self.tempdir, 'tree')
+        self.packages = os.path.join(self.tempdir, 'Packages')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_generate_and_run(self):
+        count = benchmark.make_source_tree(self.root, groups=2, packages=3,
+                                           changelog_entries=5)
+        self.assertEqual(count, 6)
+        stanzas = benchmark.make_packages_file(self.packages, stanzas=50,
+                                               groups=2, packages=3)
+        self.assertEqual(stanzas, 50)
+
+        results = benchmark.run(self.root, self.packages, count, stanzas)
+        stages = [r['stage'] for r in results]
+        self.assertEqual(stages[0], 'find_debian_files')
+        self.assertIn('build_package_graph', stages)
+        for r in results:
+            self.assertGreaterEqual(r['seconds'], 0)
+            self.assertIsNone(r['peak_mb'])
+        outdated = [r for r in results if r['stage'] == 'find_newer_source']
+        self.assertEqual(outdated[0]['items'], count)
+        self.assertIn('build_repository_table',
+                      benchmark.format_results(results))
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
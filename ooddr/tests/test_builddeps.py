@@ -0,0 +1,302 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import networkx as nx
+from six import StringIO
+
+from .. import stats
+from ..builddeps import rebuild_subgraph, plan_builds, run_builds, \
+    BinaryIndex, Control, Needs, SourcePackage, build_package_graph, \
+    add_repository_data
+
+BUILD_SCRIPT = """
+import os, sys
+name = os.path.basename(sys.argv[2])
+with open(sys.argv[1], 'a') as stream:
+    stream.write(name + '\\n')
+sys.exit(1 if name == 'kdepimlibs' else 0)
+"""
+
+CONTROLS = {
+    'kdelibs': """Source: kdelibs
+Build-Depends: cmake, libqt4-dev
+
+Package: kdelibs5
+Provides: kdelibs-runtime
+
+Package: kdelibs5-dev
+""",
+    'kdepimlibs': """Source: kdepimlibs
+Build-Depends: kdelibs5-dev (>= 4:4.8), gpgme-dev | libgpgme11-dev
+
+Package: kdepimlibs5
+""",
+    'kde-runtime': """Source: kde-runtime
+Build-Depends: kdelibs-runtime, cmake | kdepimlibs5
+
+Package: kde-runtime
+""",
+    'kdepim': """Source: kdepim
+Build-Depends: foo-dev | kdepimlibs5, kdepim
+
+Package: kdepim
+""",
+}
+
+def make_packages():
+    packages = {}
+    for name, text in CONTROLS.items():
+        paragraphs = list(Control.iter_paragraphs(StringIO(text)))
+        packages[name] = SourcePackage(paragraphs, '1.0-1', '/' + name)
+    return packages
+
+
+class TestBinaryIndex(unittest.TestCase):
+    def setUp(self):
+        self.packages = make_packages()
+        self.index = BinaryIndex(self.packages)
+        for stanza in [{'Package': 'cmake'},
+                       {'Package': 'libgpgme11-dev', 'Source': 'gpgme1.0',
+                        'Provides': 'gpgme-dev'},
+                       {'Package': 'kdelibs5', 'Source': 'kdelibs (4:4.8.4-2)'}]:
+            self.index.add_repository(stanza)
+
+    def test_lookup(self):
+        self.assertEqual(self.index.local_source('kdelibs5-dev').name,
+                         'kdelibs')
+        self.assertEqual(self.index.local_source('kdelibs-runtime').name,
+                         'kdelibs')
+        self.assertEqual(self.index.repository['gpgme-dev'], 'gpgme1.0')
+        self.assertEqual(self.index.repository['kdelibs5'], 'kdelibs')
+
+    def test_records(self):
+        kdepimlibs = self.packages['kdepimlibs']
+        self.assertEqual([(n.binary, n.group) for n in kdepimlibs.needs],
+                         [('kdelibs5-dev', 0), ('gpgme-dev', 1),
+                          ('libgpgme11-dev', 1)])
+        self.assertEqual(kdepimlibs.needs[0].version_expression,
+                         ('>=', '4:4.8'))
+        self.assertEqual(self.packages['kdelibs'].provides[0].virtuals,
+                         ('kdelibs-runtime',))
+
+        text = 'Source: kdelibs\nBuild-Depends: cmake\n' \
+            'Build-Depends-Indep: doxygen | doxygen-latex\n\nPackage: kdelibs5\n'
+        paragraphs = list(Control.iter_paragraphs(StringIO(text)))
+        kdelibs = SourcePackage(paragraphs, '1.0-1', '/kdelibs')
+        self.assertEqual([(n.binary, n.group) for n in kdelibs.needs],
+                         [('cmake', 0), ('doxygen', 1), ('doxygen-latex', 1)])
+
+        # only the newest repository version is kept
+        for version in ['0.9-1', '1.0-2', '1.0-1']:
+            kdepimlibs.add_repository_version(version)
+        self.assertEqual(kdepimlibs.repository_version, '1.0-2')
+        self.assertFalse(kdepimlibs.outdated)
+
+    def test_resolve(self):
+        missing = Needs('missing', None, 0)
+        gpgme = Needs('gpgme-dev', None, 0)
+        self.assertEqual(self.index.resolve([missing, gpgme]), 'gpgme1.0')
+        self.assertEqual(self.index.resolve([missing]), None)
+
+    def test_repository_data(self):
+        tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        filename = os.path.join(tempdir, 'Packages')
+        with open(filename, 'w') as stream:
+            stream.write('Package: kdelibs5\nSource: kdelibs\n'
+                         'Version: 1.0-2\n\nPackage: other\n'
+                         'Version: 1.0-1\n')
+        counters = []
+        try:
+            for offsets in (False, True):
+                packages = make_packages()
+                collected = stats.enable()
+                add_repository_data(packages, filename, offsets=offsets)
+                stats.disable()
+                self.assertEqual(packages['kdelibs'].repository_version,
+                                 '1.0-2')
+                counters.append((collected.counters['files read'],
+                                 collected.counters['bytes read']))
+        finally:
+            stats.disable()
+            shutil.rmtree(tempdir)
+        # the same files are counted with or without the offset index
+        self.assertEqual(counters[0], counters[1])
+
+    def test_graph(self):
+        deps = build_package_graph(self.packages, self.index)
+        edges = sorted((a.name, b.name) for a, b in deps.edges())
+        # kde-runtime gets cmake from the repository, so it doesn't
+        # need kdepimlibs, and kdepim doesn't depend on itself
+        self.assertEqual(edges, [('kdelibs', 'kde-runtime'),
+                                 ('kdelibs', 'kdepimlibs'),
+                                 ('kdepimlibs', 'kdepim')])
+
+
+class FakeSource(object):
+    def __init__(self, name, outdated=False):
+        self.name = name
+        self.outdated = outdated
+        self.version = '1.0-1'
+        self.package_dir = os.path.join('/nonexistent', name)
+
+    def __repr__(self):
+        return self.name
+
+
+def make_graph(edges, outdated):
+    nodes = {}
+    deps = nx.DiGraph()
+    for a, b in edges:
+        for name in (a, b):
+            if name not in nodes:
+                nodes[name] = FakeSource(name, name in outdated)
+        deps.add_edge(nodes[a], nodes[b])
+    return deps, nodes
+
+
+class TestPlanBuilds(unittest.TestCase):
+    def setUp(self):
+        #  kdelibs -> kdepimlibs -> kdepim
+        #  kdelibs -> kde-runtime
+        #  qt -> kdelibs
+        self.deps, self.nodes = make_graph(
+            [('qt', 'kdelibs'),
+             ('kdelibs', 'kdepimlibs'),
+             ('kdepimlibs', 'kdepim'),
+             ('kdelibs', 'kde-runtime')],
+            outdated=['kdelibs', 'kde-runtime'])
+
+    def names(self, packages):
+        return [p.name for p in packages]
+
+    def test_rebuild_subgraph(self):
+        graph = rebuild_subgraph(self.deps)
+        self.assertEqual(sorted(self.names(graph)),
+                         ['kde-runtime', 'kdelibs', 'kdepim', 'kdepimlibs'])
+
+    def test_waves(self):
+        waves, critical_path, duration = plan_builds(self.deps)
+        self.assertEqual([self.names(w) for w in waves],
+                         [['kdelibs'], ['kde-runtime', 'kdepimlibs'],
+                          ['kdepim']])
+        self.assertEqual(self.names(critical_path),
+                         ['kdelibs', 'kdepimlibs', 'kdepim'])
+        self.assertEqual(duration, 3)
+
+    def test_costs(self):
+        costs = {'kdelibs': 60, 'kde-runtime': 100, 'kdepimlibs': 10,
+                 'kdepim': 20}
+        waves, critical_path, duration = plan_builds(self.deps, costs)
+        self.assertEqual(self.names(critical_path),
+                         ['kdelibs', 'kde-runtime'])
+        self.assertEqual(duration, 160)
+
+    def test_cycle(self):
+        deps, nodes = make_graph([('qt', 'kdelibs'),
+                                  ('kdelibs', 'kdepimlibs'),
+                                  ('kdepimlibs', 'kdelibs'),
+                                  ('kdepimlibs', 'kdepim')],
+                                 outdated=['qt'])
+        waves, critical_path, duration = plan_builds(deps)
+        self.assertEqual([self.names(w) for w in waves],
+                         [['qt'], ['kdelibs', 'kdepimlibs'], ['kdepim']])
+        self.assertEqual(self.names(critical_path),
+                         ['qt', 'kdelibs', 'kdepimlibs', 'kdepim'])
+        self.assertEqual(duration, 4)
+
+    def test_nothing_to_build(self):
+        deps, nodes = make_graph([('qt', 'kdelibs')], outdated=[])
+        self.assertEqual(plan_builds(deps), ([], [], 0))
+
+
+class TestRunBuilds(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        self.log = os.path.join(self.tempdir, 'built')
+        self.state = os.path.join(self.tempdir, 'state.json')
+        self.command = [sys.executable, '-c', BUILD_SCRIPT, self.log]
+        self.deps, self.nodes = make_graph(
+            [('kdelibs', 'kdepimlibs'),
+             ('kdepimlibs', 'kdepim'),
+             ('kdelibs', 'kde-runtime')],
+            outdated=['kdelibs'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def built(self):
+        with open(self.log) as stream:
+            return stream.read().split()
+
+    def test_run_and_resume(self):
+        status = run_builds(self.deps, self.command, 2, self.state)
+        self.assertEqual(status, {'kdelibs': 'done',
+                                  'kde-runtime': 'done',
+                                  'kdepimlibs': 'failed',
+                                  'kdepim': 'skipped'})
+        self.assertEqual(self.built()[0], 'kdelibs')
+        self.assertEqual(sorted(self.built()[1:]),
+                         ['kde-runtime', 'kdepimlibs'])
+
+        with open(self.state) as stream:
+            state = json.load(stream)
+        self.assertEqual(state['kdelibs']['status'], 'done')
+        self.assertTrue('kdepim' not in state)
+
+        os.unlink(self.log)
+        status = run_builds(self.deps, self.command, 2, self.state)
+        # only the failed package is tried again
+        self.assertEqual(self.built(), ['kdepimlibs'])
+        self.assertEqual(status['kdelibs'], 'done')
+
+    def test_rebuilt_dependency(self):
+        run_builds(self.deps, self.command, 2, self.state)
+        with open(self.state) as stream:
+            state = json.load(stream)
+        del state['kdelibs']
+        with open(self.state, 'w') as stream:
+            json.dump(state, stream)
+
+        os.unlink(self.log)
+        run_builds(self.deps, self.command, 2, self.state)
+        # kde-runtime was done, but against the old kdelibs
+        self.assertEqual(self.built()[0], 'kdelibs')
+        self.assertIn('kde-runtime', self.built())
+
+    def test_cycle(self):
+        deps, nodes = make_graph([('qt', 'kdelibs'),
+                                  ('kdelibs', 'kdepimlibs'),
+                                  ('kdepimlibs', 'kdelibs'),
+                                  ('kdepimlibs', 'kdepim')],
+                                 outdated=['qt'])
+        status = run_builds(deps, [sys.executable, '-c', 'pass'], 2)
+        self.assertEqual(status, {'qt': 'done', 'kdelibs': 'done',
+                                  'kdepimlibs': 'done', 'kdepim': 'done'})
+
+        # the builder fails kdepimlibs, the second package of the cycle
+        status = run_builds(deps, self.command, 2, self.state)
+        self.assertEqual(self.built(), ['qt', 'kdelibs', 'kdepimlibs'])
+        self.assertEqual(status, {'qt': 'done', 'kdelibs': 'done',
+                                  'kdepimlibs': 'failed',
+                                  'kdepim': 'skipped'})
+
+    def test_missing_command(self):
+        command = [os.path.join(self.tempdir, 'missing')]
+        status = run_builds(self.deps, command, 2, self.state)
+        self.assertEqual(status, {'kdelibs': 'failed',
+                                  'kde-runtime': 'skipped',
+                                  'kdepimlibs': 'skipped',
+                                  'kdepim': 'skipped'})
+        with open(self.state) as stream:
+            self.assertEqual(json.load(stream)['kdelibs']['status'],
+                             'failed')
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,14 @@ CHANGELOG = """package (1.2.3-4) experimental; urgency=low
  -- Debian Developer <example@debian.org>  Wed, 02 Jan 2013 03:45:57 +0000
 """
 
+OLD_ENTRY = """
+package (1.2.3-3) experimental; urgency=low
+
+  * An older version
+
+ -- Debian Developer <example@debian.org>  Tue, 01 Jan 2013 03:45:57 +0000
+"""
+
 class TestChangelog(unittest.TestCase):
     def test_repr(self):
 
@@ -37,6 +45,22 @@ class TestChangelog(unittest.TestCase):
         self.assertEqual(vers[2], newdebian)
         self.assertEqual(vers[3], new_version)
 
+    def test_head(self):
+        stream = StringIO(CHANGELOG + OLD_ENTRY)
+        log = OrderedChangelog()
+        log.parse_changelog_head(stream)
+        self.assertEqual(len(log), 1)
+        self.assertEqual(log, NativeVersion('1.2.3-4'))
+        # the older entry wasn't read
+        self.assertEqual(stream.read(), OLD_ENTRY)
+
+    def test_cached_key(self):
+        log = OrderedChangelog(StringIO(CHANGELOG))
+        key = log.key
+        self.assertTrue(log.key is key)
+        log.set_version('1.2.3-5')
+        self.assertTrue(log > '1.2.3-4')
+
 
 
 def test_suite():
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import pdood
+from ..checksums import find_tarballs, sha256_file
+from ..scancache import ScanCache
+
+FILES = {
+    'kdelibs_4.8.4.orig.tar.xz': b'upstream sources',
+    'kdelibs_4.8.4-1.debian.tar.gz': b'packaging',
+    'kdelibs_4.8.4.orig-docs.tar.xz': b'documentation',
+}
+
+class TestChecksums(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        self.source_dir = os.path.join(self.tempdir, 'kde', 'kdelibs')
+        # the unpacked source isn't searched for tarballs
+        debian_dir = os.path.join(self.source_dir, 'kdelibs-4.8.4', 'debian')
+        os.makedirs(debian_dir)
+        for name in ('control', 'changelog'):
+            with open(os.path.join(debian_dir, name), 'w') as stream:
+                stream.write('')
+        with open(os.path.join(self.source_dir, 'kdelibs-4.8.4',
+                               'skipped.tar.gz'), 'w') as stream:
+            stream.write('')
+        files = []
+        sums = []
+        for name, data in FILES.items():
+            with open(os.path.join(self.source_dir, name), 'wb') as stream:
+                stream.write(data)
+            sums.append(' {} {} {}'.format(
+                hashlib.sha256(data).hexdigest(), len(data), name))
+            files.append(' {} {} {}'.format(
+                hashlib.md5(data).hexdigest(), len(data), name))
+        files.append(' 00000000000000000000000000000000 5 missing.tar.gz')
+        with open(os.path.join(self.source_dir, 'kdelibs_4.8.4-1.dsc'),
+                  'w') as stream:
+            stream.write('Source: kdelibs\nVersion: 4:4.8.4-1\nFiles:\n'
+                         + '\n'.join(files) + '\nChecksums-Sha256:\n'
+                         + '\n'.join(sums) + '\n')
+        self.cache = ScanCache(os.path.join(self.tempdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def verify(self, root=None):
+        root = root or self.tempdir
+        files = pdood.find_debian_files(root)
+        dscs, dsc_files = pdood.build_dsc_tables(files)
+        report = pdood.verify_dsc_files(dsc_files, find_tarballs(root),
+                                        jobs=2, cache=self.cache)
+        return dict(zip(report.name, report.Status))
+
+    def test_index(self):
+        tarballs = find_tarballs(self.tempdir)
+        self.assertEqual(len(tarballs), 3)
+        origs = tarballs.find_origs('kdelibs', '4.8.4')
+        self.assertEqual(sorted(os.path.basename(p) for p in origs),
+                         ['kdelibs_4.8.4.orig-docs.tar.xz',
+                          'kdelibs_4.8.4.orig.tar.xz'])
+
+    def test_sha256(self):
+        path = os.path.join(self.source_dir, 'kdelibs_4.8.4.orig.tar.xz')
+        self.assertEqual(sha256_file(path, chunk_size=3),
+                         hashlib.sha256(FILES['kdelibs_4.8.4.orig.tar.xz'])
+                         .hexdigest())
+
+    def test_verify(self):
+        status = self.verify()
+        self.assertEqual(status['missing.tar.gz'], 'missing')
+        self.assertEqual(status['kdelibs_4.8.4.orig.tar.xz'], 'ok')
+        self.assertEqual(self.cache.misses, 3)
+
+        with open(os.path.join(self.source_dir, 'kdelibs_4.8.4.orig.tar.xz'),
+                  'wb') as stream:
+            stream.write(b'upstream s0urces')
+        with open(os.path.join(self.source_dir,
+                               'kdelibs_4.8.4-1.debian.tar.gz'),
+                  'wb') as stream:
+            stream.write(b'short')
+        status = self.verify()
+        self.assertEqual(status['kdelibs_4.8.4.orig.tar.xz'], 'sha256')
+        self.assertEqual(status['kdelibs_4.8.4-1.debian.tar.gz'], 'size')
+        # only the changed file of the right size is hashed again
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 4)
+
+    def test_verify_empty(self):
+        empty = os.path.join(self.tempdir, 'empty')
+        os.mkdir(empty)
+        self.assertEqual(self.verify(empty), {})
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
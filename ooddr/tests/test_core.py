@@ -0,0 +1,137 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from .. import core
+from .test_changelog import CHANGELOG
+
+CONTROL = """Source: package
+Build-Depends: debhelper (>= 9)
+
+Package: package-bin
+"""
+
+PACKAGES = """Package: package-bin
+Source: package
+Version: 1.2.3-3
+
+Package: package-data
+Source: package (1.2.3-2)
+Version: 1:0.1
+
+Package: other
+Version: 2.0-1
+"""
+
+class TestCore(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        self.package_dir = os.path.join(self.tempdir, 'kde', 'package-1.2.3')
+        debian_dir = os.path.join(self.package_dir, 'debian')
+        os.makedirs(debian_dir)
+        os.makedirs(os.path.join(self.tempdir, '.git', 'debian'))
+        with open(os.path.join(debian_dir, 'control'), 'w') as stream:
+            stream.write(CONTROL)
+        with open(os.path.join(debian_dir, 'changelog'), 'w') as stream:
+            stream.write(CHANGELOG)
+        self.packages = os.path.join(self.tempdir, 'Packages')
+        with open(self.packages, 'w') as stream:
+            stream.write(PACKAGES)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_iter_sources(self):
+        records = list(core.iter_sources(self.tempdir))
+        self.assertEqual(records, [{'Source': 'package',
+                                    'Version': '1.2.3-4',
+                                    'Directory': self.package_dir}])
+
+    def test_short_dir_names(self):
+        # "de" isn't a debian directory, so what is below it is found
+        package_dir = os.path.join(self.tempdir, 'de', 'other-1.0')
+        debian_dir = os.path.join(package_dir, 'debian')
+        os.makedirs(debian_dir)
+        with open(os.path.join(debian_dir, 'control'), 'w') as stream:
+            stream.write('Source: other\n')
+        with open(os.path.join(debian_dir, 'changelog'), 'w') as stream:
+            stream.write('other (2.0-1) unstable; urgency=low\n')
+        found = sorted(core.walk_debian_files(self.tempdir))
+        self.assertEqual(found, [('package', package_dir),
+                                 ('package', self.package_dir)])
+
+    def test_repository_versions(self):
+        versions = core.repository_versions(self.packages)
+        self.assertEqual(versions, {'package': '1.2.3-3', 'other': '2.0-1'})
+        self.assertEqual(core.repository_versions(self.packages, ['other']),
+                         {'other': '2.0-1'})
+        self.assertEqual(core.repository_versions(self.packages, ['package'],
+                                                  offsets=True),
+                         {'package': '1.2.3-3'})
+
+    def test_several_indices(self):
+        experimental = os.path.join(self.tempdir, 'dists', 'experimental',
+                                    'main', 'binary-amd64', 'Packages')
+        os.makedirs(os.path.dirname(experimental))
+        with open(experimental, 'w') as stream:
+            stream.write('Package: package-bin\nSource: package\n'
+                         'Version: 1.2.3-5\n')
+        sources = os.path.join(self.tempdir, 'Sources')
+        with open(sources, 'w') as stream:
+            stream.write('Package: other\nBinary: other\nVersion: 2.0-2\n')
+
+        indices = [self.packages, experimental, sources]
+        expected = {'package': '1.2.3-5', 'other': '2.0-2'}
+        self.assertEqual(core.repository_versions(indices, jobs=1), expected)
+        self.assertEqual(core.repository_versions(indices, jobs=2), expected)
+
+    def test_is_outdated(self):
+        record = core.read_source_record(self.package_dir)
+        self.assertTrue(core.is_outdated(record, {'package': '1.2.3-3'}))
+        self.assertFalse(core.is_outdated(record, {'package': '1.2.3-4'}))
+        self.assertFalse(core.is_outdated(record, {}))
+
+    def test_iter_outdated(self):
+        versions = core.repository_versions(self.packages)
+        records = list(core.iter_outdated(self.tempdir, versions))
+        self.assertEqual(records, [{'Source': 'package',
+                                    'Version': '1.2.3-4',
+                                    'Repository': '1.2.3-3',
+                                    'Directory': self.package_dir}])
+        versions['package'] = '1.2.3-5'
+        self.assertEqual(list(core.iter_outdated(self.tempdir, versions)), [])
+
+    def test_stream_csv(self):
+        script = os.path.join(os.path.dirname(__file__), '..', '..',
+                              'outdated')
+        output = subprocess.check_output(
+            [sys.executable, script, '-p', self.packages, '-f', 'csv',
+             self.tempdir])
+        self.assertEqual(output.decode('utf-8').splitlines(), [
+            'Source,Version,Repository,Directory',
+            'package,1.2.3-4,1.2.3-3,' + self.package_dir])
+
+    def test_stats_before_root(self):
+        script = os.path.join(os.path.dirname(__file__), '..', '..',
+                              'outdated')
+        result = subprocess.run(
+            [sys.executable, script, '--stats', '-l', self.tempdir],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        self.assertIn(b'package 1.2.3-4', result.stdout)
+        self.assertTrue(result.stderr.startswith(b'stage'))
+
+    def test_no_heavy_imports(self):
+        code = ('import sys, ooddr.core; '
+                'print(any(m in sys.modules for m in '
+                '("pandas", "numpy", "networkx", "debian")))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'False')
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
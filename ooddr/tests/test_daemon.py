@@ -0,0 +1,130 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from .. import daemon
+
+CHANGELOG = """{0} ({1}) unstable; urgency=low
+
+  * New upstream release.
+
+ -- Debian Qt/KDE Maintainers <debian-qt-kde@lists.debian.org>  Wed, 02 Jan 2013 03:45:57 +0000
+"""
+
+CONTROL = """Source: {0}
+Build-Depends: {2}
+
+Package: {1}
+Architecture: any
+"""
+
+# kdelibs <- kdepimlibs <- kdepim, only kdelibs is newer than the
+# repository
+SOURCES = [('kdelibs', 'kdelibs5-dev', 'cmake', '4:4.8.4-2'),
+           ('kdepimlibs', 'kdepimlibs5-dev', 'kdelibs5-dev', '4:4.8.4-1'),
+           ('kdepim', 'kdepim', 'kdepimlibs5-dev', '4:4.8.4-1')]
+
+PACKAGES = """Package: kdelibs5-dev
+Source: kdelibs
+Version: 4:4.8.4-1
+
+Package: kdepimlibs5-dev
+Source: kdepimlibs
+Version: 4:4.8.4-1
+
+Package: kdepim
+Version: 4:4.8.4-1
+
+Package: cmake
+Version: 2.8.9-1
+"""
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        self.root = os.path.join(self.tempdir, 'tree')
+        for name, binary, build_depends, version in SOURCES:
+            debian_dir = os.path.join(self.root, 'kde', name, 'debian')
+            os.makedirs(debian_dir)
+            with open(os.path.join(debian_dir, 'control'), 'w') as stream:
+                stream.write(CONTROL.format(name, binary, build_depends))
+            with open(os.path.join(debian_dir, 'changelog'), 'w') as stream:
+                stream.write(CHANGELOG.format(name, version))
+        self.packages = os.path.join(self.tempdir, 'Packages')
+        with open(self.packages, 'w') as stream:
+            stream.write(PACKAGES)
+        self.tree = daemon.Tree(self.root, self.packages)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def names(self, records):
+        return [r['Source'] for r in records]
+
+    def test_queries(self):
+        self.assertEqual(self.names(self.tree.outdated()), ['kdelibs'])
+        self.assertEqual(self.tree.rdeps('kdelibs'), ['kdepim', 'kdepimlibs'])
+        self.assertEqual(self.tree.rdeps('kdepimlibs5-dev'), ['kdepim'])
+        self.assertEqual(self.tree.rebuild(['kdepimlibs']),
+                         ['kdepimlibs', 'kdepim'])
+        self.assertEqual(self.tree.order()['waves'],
+                         [['kdelibs'], ['kdepimlibs'], ['kdepim']])
+        self.assertRaises(ValueError, self.tree.query, {'query': 'nothing'})
+
+    def test_update(self):
+        self.assertFalse(self.tree.scan())
+        package_dir = self.tree.outdated()[0]['Directory']
+        graph = self.tree.graph()
+
+        changelog = os.path.join(package_dir, 'debian', 'changelog')
+        with open(changelog, 'a') as stream:
+            stream.write('\n')
+        self.tree.changed(changelog)
+        # changes to the upstream sources are ignored
+        self.tree.changed(os.path.join(package_dir, 'src', 'main.cpp'))
+        self.assertTrue(self.tree.apply_pending())
+        self.assertIsNot(self.tree.graph(), graph)
+
+        shutil.rmtree(package_dir)
+        self.assertTrue(self.tree.scan())
+        self.assertEqual(self.tree.outdated(), [])
+
+    def test_socket(self):
+        socket_path = os.path.join(self.tempdir, 'socket')
+        server = daemon.QueryServer(socket_path, self.tree)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            outdated = daemon.query(socket_path, {'query': 'outdated',
+                                                  'root': self.root})
+            self.assertEqual(self.names(outdated), ['kdelibs'])
+            self.assertRaises(RuntimeError, daemon.query, socket_path,
+                              {'query': 'rdeps', 'name': 'missing'})
+            # a second daemon doesn't take the socket of a running one
+            self.assertRaises(OSError, daemon.QueryServer, socket_path,
+                              self.tree)
+            self.assertEqual(daemon.query(socket_path, {'query': 'ping'}),
+                             'pong')
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.assertFalse(os.path.exists(socket_path))
+
+    def test_stale_socket(self):
+        socket_path = os.path.join(self.tempdir, 'socket')
+        # bound by a daemon that was killed, nothing listens on it
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(socket_path)
+        stale.close()
+        server = daemon.QueryServer(socket_path, self.tree)
+        server.server_close()
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
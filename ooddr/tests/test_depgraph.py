@@ -0,0 +1,70 @@
+import unittest
+
+import networkx as nx
+
+from ..depgraph import DepGraph
+from .test_builddeps import make_graph
+
+EDGES = [('qt', 'kdelibs'),
+         ('kdelibs', 'kdepimlibs'),
+         ('kdepimlibs', 'kdepim'),
+         ('kdelibs', 'kde-runtime')]
+
+class TestDepGraph(unittest.TestCase):
+    def setUp(self):
+        deps, nodes = make_graph(EDGES, outdated=[])
+        self.graph = DepGraph.from_networkx(deps)
+
+    def check_queries(self):
+        graph = self.graph
+        self.assertEqual(graph.rdeps('kdelibs'),
+                         ['kde-runtime', 'kdepim', 'kdepimlibs'])
+        self.assertEqual(graph.rdeps('kdepim'), [])
+        self.assertTrue(graph.is_upstream('qt', 'kdepim'))
+        self.assertFalse(graph.is_upstream('kdepim', 'qt'))
+        self.assertFalse(graph.is_upstream('kde-runtime', 'kdepim'))
+        rebuild = graph.rebuild_set(['kdepimlibs', 'kde-runtime', 'missing'])
+        self.assertEqual(sorted(rebuild),
+                         ['kde-runtime', 'kdepim', 'kdepimlibs'])
+        self.assertLess(rebuild.index('kdepimlibs'), rebuild.index('kdepim'))
+
+    def test_csr(self):
+        graph = self.graph
+        self.assertEqual(len(graph), 5)
+        self.assertEqual(graph.indptr.tolist(), [0, 0, 2, 2, 3, 4])
+        self.assertEqual(sorted(graph.dependents('kdelibs')),
+                         ['kde-runtime', 'kdepimlibs'])
+        self.assertEqual(graph.dependencies('kdelibs'), ['qt'])
+
+    def test_traversal(self):
+        self.check_queries()
+        self.assertIsNone(self.graph.closure)
+
+    def test_closure(self):
+        self.graph.compute_closure()
+        self.check_queries()
+
+    def test_update(self):
+        self.graph.compute_closure()
+        self.graph.add_edge('kdepimlibs', 'akonadi')
+        self.graph.add_edge('akonadi', 'kdepim')
+        updated = list(self.graph.closure)
+        self.assertEqual(updated, self.graph.compute_closure())
+        self.assertTrue(self.graph.is_upstream('kdelibs', 'akonadi'))
+
+        self.graph.remove_edge('kdelibs', 'kdepimlibs')
+        self.assertFalse(self.graph.is_upstream('kdelibs', 'akonadi'))
+        self.assertEqual(self.graph.rdeps('qt'), ['kde-runtime', 'kdelibs'])
+
+    def test_cycle(self):
+        graph = DepGraph(edges=[('a', 'b'), ('b', 'c'), ('c', 'a'),
+                                ('c', 'd')])
+        graph.compute_closure()
+        self.assertEqual(graph.rdeps('b'), ['a', 'b', 'c', 'd'])
+        self.assertEqual(sorted(graph.rebuild_set(['d'])), ['d'])
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+import unittest
+from six import StringIO
+
+from ..packages import open_index, read_columns, iter_stanzas, \
+    PackagesIndex, parse_index_spec
+
+PACKAGES = """Package: kde-runtime
+Source: kde-runtime
+Version: 4:4.8.4-2
+Architecture: amd64
+Description: runtime components from the official KDE release
+ Multi line
+ .
+ description
+
+Package: kde-runtime-data
+source: kde-runtime (4:4.8.4-2)
+Version: 4:4.8.4-2
+Architecture: all
+
+Package: cmake
+Version: 2.8.9-1
+Architecture: amd64
+"""
+
+class TestPackages(unittest.TestCase):
+    def test_read_columns(self):
+        columns = read_columns(StringIO(PACKAGES))
+        self.assertEqual(list(columns),
+                         ['Package', 'Source', 'Version', 'Architecture',
+                          'Provides'])
+        self.assertEqual(columns['Package'],
+                         ['kde-runtime', 'kde-runtime-data', 'cmake'])
+        self.assertEqual(columns['Source'],
+                         ['kde-runtime', 'kde-runtime (4:4.8.4-2)', None])
+        self.assertEqual(columns['Architecture'], ['amd64', 'all', 'amd64'])
+
+    def test_read_all_columns(self):
+        columns = read_columns(StringIO(PACKAGES), None)
+        self.assertEqual(columns['Description'],
+                         ['runtime components from the official KDE release'
+                          '\n Multi line\n .\n description', None, None])
+        self.assertEqual(columns['Source'], ['kde-runtime',
+                                             'kde-runtime (4:4.8.4-2)',
+                                             None])
+
+    def test_iter_stanzas(self):
+        stanzas = list(iter_stanzas(StringIO(PACKAGES), ['Package', 'Source']))
+        self.assertEqual(stanzas, [
+            {'Package': 'kde-runtime', 'Source': 'kde-runtime'},
+            {'Package': 'kde-runtime-data',
+             'Source': 'kde-runtime (4:4.8.4-2)'},
+            {'Package': 'cmake'},
+        ])
+
+    def test_index_spec(self):
+        self.assertEqual(
+            parse_index_spec('/srv/dists/sid/main/binary-i386/Packages.xz'),
+            ('/srv/dists/sid/main/binary-i386/Packages.xz', 'sid', 'i386'))
+        self.assertEqual(
+            parse_index_spec('/var/lib/apt/lists/deb.debian.org_debian_dists_'
+                             'experimental_main_source_Sources'),
+            ('/var/lib/apt/lists/deb.debian.org_debian_dists_experimental_'
+             'main_source_Sources', 'experimental', 'source'))
+        self.assertEqual(parse_index_spec('ppa=/tmp/Packages'),
+                         ('/tmp/Packages', 'ppa', None))
+        self.assertEqual(parse_index_spec('/tmp/a=b/Packages'),
+                         ('/tmp/a=b/Packages', None, None))
+        # only the file name of apt lists is split on _
+        self.assertEqual(parse_index_spec('/srv/my_dists_x/Packages'),
+                         ('/srv/my_dists_x/Packages', None, None))
+
+    def test_compressed(self):
+        tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        try:
+            for ext, opener in (('.gz', gzip.open), ('.xz', lzma.open)):
+                filename = os.path.join(tempdir, 'Packages' + ext)
+                with opener(filename, 'wt') as stream:
+                    stream.write(PACKAGES)
+                with open_index(filename) as stream:
+                    columns = read_columns(stream, ['Version'])
+                self.assertEqual(columns['Version'],
+                                 ['4:4.8.4-2', '4:4.8.4-2', '2.8.9-1'])
+        finally:
+            shutil.rmtree(tempdir)
+
+class TestPackagesIndex(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        self.filename = os.path.join(self.tempdir, 'Packages')
+        with open(self.filename, 'w') as stream:
+            stream.write(PACKAGES.replace('Architecture: all',
+                                          'Provides: kde-data\n'
+                                          'Architecture: all'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def names(self, index, names, **kwargs):
+        return [s['Package'] for s in index.lookup(names, **kwargs)]
+
+    def test_lookup(self):
+        with PackagesIndex(self.filename) as index:
+            self.assertEqual(self.names(index, ['cmake']), ['cmake'])
+            self.assertEqual(self.names(index, ['kde-runtime']),
+                             ['kde-runtime', 'kde-runtime-data'])
+            self.assertEqual(self.names(index, ['kde-runtime'],
+                                        tables=(index.packages,)),
+                             ['kde-runtime'])
+            self.assertEqual(self.names(index, ['kde-data']),
+                             ['kde-runtime-data'])
+            self.assertEqual(self.names(index, ['missing']), [])
+        self.assertTrue(os.path.exists(self.filename + '.offsets'))
+
+    def test_empty(self):
+        open(self.filename, 'w').close()
+        with PackagesIndex(self.filename) as index:
+            self.assertEqual(list(index.lookup(['cmake'])), [])
+            self.assertEqual(index.read(0), {})
+
+    def test_stale(self):
+        PackagesIndex(self.filename).close()
+        with open(self.filename, 'a') as stream:
+            stream.write('\nPackage: added\nVersion: 1.0-1\n')
+        with PackagesIndex(self.filename) as index:
+            stanzas = list(index.lookup(['added']))
+        self.assertEqual(stanzas, [{'Package': 'added', 'Version': '1.0-1'}])
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
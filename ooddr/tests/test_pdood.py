@@ -0,0 +1,211 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from ..pdood import build_candidates, find_unsatisfied, \
+    build_source_versions, find_newer_source, build_repository_table, \
+    read_debian_records, find_debian_files, build_package_tables
+from .test_changelog import CHANGELOG
+
+
+def make_needs(relations):
+    rows = []
+    for source, group, name, version in relations:
+        rows.append({'name': name, 'version': version,
+                     'Group': group, 'Source': source})
+    return pd.DataFrame(rows)
+
+
+class TestParallelScan(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        for group, name in (('kde', 'kdelibs'), ('kde', 'kdepim'),
+                            ('qt', 'qt4-x11'), ('qt', 'qtwebkit')):
+            debian_dir = os.path.join(self.tempdir, group, name, 'debian')
+            os.makedirs(debian_dir)
+            with open(os.path.join(debian_dir, 'control'), 'w') as stream:
+                stream.write('Source: {0}\nBuild-Depends: cmake\n\n'
+                             'Package: {0}-dev\n'.format(name))
+            with open(os.path.join(debian_dir, 'changelog'), 'w') as stream:
+                stream.write(CHANGELOG)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def scan(self, jobs):
+        files = find_debian_files(self.tempdir, jobs=jobs)
+        files = files.sort_values('filename').reset_index(drop=True)
+        source, needs, provides = build_package_tables(files, jobs=jobs)
+        versions = [str(v) for v in source.Version]
+        return files, source[['Source']].assign(Version=versions), \
+            needs, provides
+
+    def test_jobs(self):
+        serial = self.scan(1)
+        parallel = self.scan(2)
+        self.assertEqual(len(serial[0]), 4)
+        for expected, table in zip(serial, parallel):
+            pd.testing.assert_frame_equal(expected, table)
+
+    def test_empty_root(self):
+        empty = os.path.join(self.tempdir, 'empty')
+        os.mkdir(empty)
+        files = find_debian_files(empty)
+        source, needs, provides = build_package_tables(files)
+        self.assertEqual(len(source), 0)
+        repository = pd.DataFrame({'Package': ['kdelibs5'],
+                                   'Source': ['kdelibs'],
+                                   'Version': ['4:4.8.4-1']})
+        self.assertEqual(len(find_newer_source(source, repository)), 0)
+        candidates = build_candidates(repository, source, provides)
+        report = find_unsatisfied(needs, candidates, source)
+        self.assertEqual(len(report), 0)
+
+class TestUnsatisfied(unittest.TestCase):
+    def setUp(self):
+        self.repository = pd.DataFrame({
+            'Package': ['cmake', 'libqt4-dev', 'libgpgme11-dev'],
+            'Version': ['2.8.9-1', '4:4.8.2-1', '1.2.0-1'],
+            'Provides': [None, None, 'gpgme-dev, libgpgme-dev (= 1.2.0)'],
+        })
+        self.source = pd.DataFrame({'Source': ['kdelibs'],
+                                    'Version': ['4:4.10.2-1']})
+        self.provides = pd.DataFrame({'Package': ['kdelibs5-dev'],
+                                      'Source': ['kdelibs']})
+        self.candidates = build_candidates(self.repository, self.source,
+                                           self.provides)
+
+    def test_candidates(self):
+        self.assertEqual(sorted(self.candidates.Package),
+                         ['cmake', 'gpgme-dev', 'kdelibs5-dev',
+                          'libgpgme-dev', 'libgpgme11-dev', 'libqt4-dev'])
+
+    def test_report(self):
+        needs = make_needs([
+            ('kdelibs', 0, 'cmake', ('>=', '2.8')),
+            ('kdelibs', 1, 'libqt4-dev', ('>=', '4:4.8.3')),
+            ('kdelibs', 2, 'foo', None),
+            ('kdelibs', 2, 'gpgme-dev', None),
+            ('kdepim', 0, 'kdelibs5-dev', ('>=', '4:4.10')),
+            ('kdepim', 1, 'gpgme-dev', ('>=', '1.0')),
+            ('kdepim', 1, 'libgpgme-dev', ('>=', '1.0')),
+            ('kdepim', 2, 'cmake', ('<<', '2.8.9-1')),
+        ])
+        report = find_unsatisfied(needs, self.candidates).set_index('Source')
+
+        self.assertEqual(report.Unsatisfied['kdelibs'],
+                         ['libqt4-dev (>= 4:4.8.3)'])
+        self.assertFalse(report.Buildable['kdelibs'])
+        # unversioned Provides can't satisfy a versioned relation,
+        # but the versioned one can
+        self.assertEqual(report.Unsatisfied['kdepim'], ['cmake (<< 2.8.9-1)'])
+
+    def test_buildable(self):
+        needs = make_needs([('kdepim', 0, 'kdelibs5-dev', ('=', '4:4.10.2-1'))])
+        report = find_unsatisfied(needs, self.candidates)
+        self.assertEqual(list(report.Buildable), [True])
+        self.assertEqual(list(report.Unsatisfied), [[]])
+
+    def test_no_build_depends(self):
+        source = pd.DataFrame({'Source': ['kdelibs', 'kdepim']})
+        needs = make_needs([('kdepim', 0, 'foo', None)])
+        report = find_unsatisfied(needs, self.candidates, source)
+        self.assertEqual(list(report.Source), ['kdelibs', 'kdepim'])
+        self.assertEqual(list(report.Buildable), [True, False])
+        report = find_unsatisfied(pd.DataFrame(), self.candidates, source)
+        self.assertEqual(list(report.Buildable), [True, True])
+
+    def test_restricted(self):
+        needs = make_needs([('kdelibs', 0, 'cmake', None),
+                            ('kdelibs', 1, 'libhurd-dev', None),
+                            ('kdelibs', 2, 'foo-test', None)])
+        needs['arch'] = [None, ['hurd-i386'], None]
+        needs['restrictions'] = [None, None, [['!nocheck']]]
+        report = find_unsatisfied(needs, self.candidates)
+        self.assertEqual(list(report.Unsatisfied), [[]])
+
+    def test_build_depends_indep(self):
+        tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        try:
+            debian_dir = os.path.join(tempdir, 'debian')
+            os.mkdir(debian_dir)
+            with open(os.path.join(debian_dir, 'control'), 'w') as stream:
+                stream.write('Source: kdelibs\nBuild-Depends: cmake\n'
+                             'Build-Depends-Indep: doxygen [amd64]\n\n'
+                             'Package: kdelibs5\n')
+            with open(os.path.join(debian_dir, 'changelog'), 'w') as stream:
+                stream.write(CHANGELOG)
+            source, needs, provides = read_debian_records(tempdir)
+        finally:
+            shutil.rmtree(tempdir)
+        self.assertEqual([(n['name'], n['Group']) for n in needs],
+                         [('cmake', 0), ('doxygen', 1)])
+        self.assertNotIn('Build-Depends-Indep', source)
+
+class TestSourceVersions(unittest.TestCase):
+    def setUp(self):
+        self.repository = pd.DataFrame({
+            'Package': ['kdelibs5', 'kdelibs5', 'kdelibs-data', 'cmake'],
+            'Source': ['kdelibs', 'kdelibs (4:4.8.4-2)', 'kdelibs', None],
+            'Version': ['4:4.8.4-1', '4:4.8.4-2+b1', '4:4.8.3-1', '2.8.9-1'],
+        })
+
+    def test_view(self):
+        view = build_source_versions(self.repository)
+        self.assertEqual(list(view.Source), ['cmake', 'kdelibs'])
+        self.assertEqual(list(view.Version), ['2.8.9-1', '4:4.8.4-2'])
+        view = build_source_versions(self.repository, ['kdelibs'])
+        self.assertEqual(list(view.Source), ['kdelibs'])
+
+    def test_newer(self):
+        source = pd.DataFrame({'Source': ['kdelibs', 'cmake', 'kdepim'],
+                               'Version': ['4:4.8.4-3', '2.8.9-1', '1.0-1']})
+        newer = find_newer_source(source, self.repository)
+        self.assertEqual(list(newer.Source), ['kdelibs'])
+        self.assertEqual(list(newer.Version_repo), ['4:4.8.4-2'])
+
+class TestRepositoryTable(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        self.indices = []
+        for path, text in (
+                ('dists/sid/main/binary-amd64/Packages',
+                 'Package: kdelibs5\nSource: kdelibs\nVersion: 4:4.8.4-1\n'
+                 'Architecture: amd64\n'),
+                ('dists/sid/main/binary-i386/Packages',
+                 'Package: kdelibs5\nSource: kdelibs\nVersion: 4:4.8.4-1\n'
+                 'Architecture: i386\n'),
+                ('dists/experimental/main/source/Sources',
+                 'Package: kdelibs\nBinary: kdelibs5, kdelibs-data\n'
+                 'Version: 4:4.10.0-1\nArchitecture: any all\n')):
+            filename = os.path.join(self.tempdir, path)
+            os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as stream:
+                stream.write(text)
+            self.indices.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_merged(self):
+        for jobs in (1, 2):
+            repository = build_repository_table(self.indices, jobs=jobs)
+            self.assertEqual(list(repository.Suite),
+                             ['sid', 'sid', 'experimental'])
+            self.assertEqual(list(repository.Arch),
+                             ['amd64', 'i386', 'source'])
+
+        view = build_source_versions(repository)
+        self.assertEqual(list(view.Version), ['4:4.10.0-1'])
+        self.assertEqual(list(view.Suite), ['experimental'])
+        candidates = build_candidates(repository)
+        self.assertEqual(list(candidates.Package), ['kdelibs5', 'kdelibs5'])
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..scancache import ScanCache, cached_map, file_stamp
+
+
+class TestScanCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        self.cache_filename = os.path.join(self.tempdir, 'cache', 'scan')
+        self.data = os.path.join(self.tempdir, 'data')
+        with open(self.data, 'w') as stream:
+            stream.write('one')
+        self.reads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def reader(self, path):
+        self.reads.append(path)
+        with open(path) as stream:
+            return stream.read()
+
+    def test_stamp(self):
+        self.assertIsNone(file_stamp(os.path.join(self.tempdir, 'missing')))
+        self.assertEqual(file_stamp(self.data), file_stamp(self.data))
+
+    def test_reuse_across_runs(self):
+        cache = ScanCache(self.cache_filename)
+        self.assertEqual(cache.fetch('t', self.data, [self.data], self.reader),
+                         'one')
+        cache.save()
+
+        cache = ScanCache(self.cache_filename)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.fetch('t', self.data, [self.data], self.reader),
+                         'one')
+        self.assertEqual(self.reads, [self.data])
+        self.assertEqual(cache.hits, 1)
+
+    def test_changed_file_is_reread(self):
+        cache = ScanCache(self.cache_filename)
+        cache.fetch('t', self.data, [self.data], self.reader)
+
+        with open(self.data, 'w') as stream:
+            stream.write('second')
+        self.assertEqual(cache.fetch('t', self.data, [self.data], self.reader),
+                         'second')
+        self.assertEqual(len(self.reads), 2)
+
+    def test_deleted_entries_dropped(self):
+        cache = ScanCache(self.cache_filename)
+        gone = os.path.join(self.tempdir, 'gone')
+        cache.put('t', gone, [], 'old')
+        cache.put('t', self.data, [self.data], 'one')
+        cache.save()
+
+        cache = ScanCache(self.cache_filename)
+        self.assertEqual(list(cache.entries), [('t', self.data)])
+
+    def test_cached_map(self):
+        cache = ScanCache()
+        cache.put('t', 'cached', [], 'from cache')
+        results = cached_map(cache, 't', self.reader, ['cached', self.data],
+                             lambda x: [])
+        self.assertEqual(results, ['from cache', 'one'])
+        self.assertEqual(self.reads, [self.data])
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import json
+import unittest
+
+from .. import stats
+
+@stats.timed('double')
+def double(x):
+    stats.count('doubled')
+    return 2 * x
+
+class TestStats(unittest.TestCase):
+    def tearDown(self):
+        stats.disable()
+
+    def test_disabled(self):
+        self.assertIsNone(stats.active())
+        self.assertEqual(double(2), 4)
+
+    def test_stages_and_counters(self):
+        events = []
+        collected = stats.enable()
+        collected.add_hook(lambda event, name, value: events.append(event))
+        double(1)
+        double(2)
+        stats.disable()
+        double(3)
+
+        self.assertEqual(collected.stages['double']['calls'], 2)
+        self.assertEqual(collected.counters, {'doubled': 2})
+        self.assertEqual(events, ['stage', 'stage'])
+
+    def test_slowest(self):
+        collected = stats.Stats(slowest=2)
+        mapper = collected.item_mapper('number')
+        self.assertEqual(mapper(double, [1, 2, 3]), [2, 4, 6])
+        collected.item('package', 'slow', 10.0)
+        report = collected.as_dict()
+        self.assertEqual(len(report['slowest']), 2)
+        self.assertEqual(report['slowest'][0]['name'], 'slow')
+        self.assertEqual(json.loads(collected.format('json')), report)
+        self.assertIn('slow', collected.format())
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import pickle
+import unittest
+from six import StringIO
+
+from debian.debian_support import NativeVersion, version_compare
+
+from ..changelog import OrderedChangelog
+from ..keyedversion import KeyedVersion
+from ..version import version_key, version_keys, VersionPool
+from .test_changelog import CHANGELOG
+
+VERSIONS = [
+    '1.0~rc1', '1.0', '1.0-0', '1.0-1', '1.0-1~bpo1', '1.0-1ubuntu1',
+    '1.0+dfsg-1', '1.0a', '1.0.0', '1.00', '1.01', '1.10', '1.9',
+    '2:0.1', '1:2.0', '0:3.0', '4.8.4-2', '4:4.8.4-2', '4.10.2-1',
+    '1.0-1-1', '1:1.0:1-2', '1.0~~', '1.0~', '1.0~a', 'a1.0',
+    '1.0-0~ppa1', '9-0~9', '9', '1a-0', '1a0-00~',
+]
+
+class TestVersionKey(unittest.TestCase):
+    def test_matches_dpkg(self):
+        for a in VERSIONS:
+            for b in VERSIONS:
+                expected = version_compare(a, b)
+                expected = (expected > 0) - (expected < 0)
+                got = (version_key(a) > version_key(b)) - \
+                      (version_key(a) < version_key(b))
+                self.assertEqual(got, expected, (a, b))
+
+    def test_version_objects(self):
+        log = OrderedChangelog(StringIO(CHANGELOG))
+        self.assertEqual(version_key(log), version_key('1.2.3-4'))
+        self.assertEqual(version_key(NativeVersion('1.2')),
+                         version_key('1.2'))
+        self.assertTrue(version_key(None) < version_key('0'))
+
+    def test_version_keys(self):
+        keys = version_keys(['1.0', '1.0~rc1', '1.0', '2.0'])
+        self.assertEqual(list(keys.argsort(kind='stable')), [1, 0, 2, 3])
+        self.assertEqual(list(keys > version_keys(['1.0~rc1'] * 4)),
+                         [True, False, True, True])
+
+class TestVersionPool(unittest.TestCase):
+    def test_shared(self):
+        pool = VersionPool(maxsize=2)
+        a = pool.get('4.10.2')
+        self.assertIs(pool.get('4.10.2'), a)
+        self.assertTrue(a < pool.get('4.10.10'))
+        self.assertTrue(a > '4.9')
+        self.assertTrue(a > OrderedChangelog(StringIO(CHANGELOG)))
+        self.assertEqual(a.key, version_key('4.10.2'))
+
+        # 4.10.2 was used last, so 4.10.10 is forgotten
+        pool.get('4.10.2')
+        pool.get('1.0')
+        self.assertEqual(len(pool), 2)
+        self.assertIs(pool.get('4.10.2'), a)
+        self.assertNotIn('4.10.10', pool.versions)
+
+    def test_invalid(self):
+        pool = VersionPool()
+        self.assertRaises(ValueError, pool.get, 'not a version')
+        self.assertEqual(pool.key('not a version'),
+                         version_key('not a version'))
+        self.assertEqual(len(pool), 0)
+
+    def test_keys(self):
+        pool = VersionPool(maxsize=2)
+        key = pool.key('4.10.2')
+        self.assertIs(pool.key('4.10.2'), key)
+        self.assertEqual(key, version_key('4.10.2'))
+        # keys don't parse versions
+        self.assertEqual(len(pool), 0)
+        pool.key('1.0')
+        pool.key('2.0')
+        self.assertEqual(list(pool.keys), ['2.0'])
+
+    def test_pickle(self):
+        version = VersionPool().get('1:4.10.2-1')
+        copy = pickle.loads(pickle.dumps(version))
+        self.assertIsInstance(copy, KeyedVersion)
+        self.assertEqual(copy.key, version.key)
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
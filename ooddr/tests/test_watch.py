@@ -1,6 +1,20 @@
+import os
+import shutil
+import tempfile
+import threading
 import unittest
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
 from six import StringIO
-from ..watch import Watch, urlunparse
+from ..watch import Watch, urlunparse, urlparse, check_all, newest_dir, \
+    ListingCache, HTTPPool, HTTPDirectory, literal_prefix, match_filelist
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import FTPServer
+except ImportError:
+    FTPServer = None
 
 FTP_SITE = 'ftp.kde.org'
 FTP_PATH = '/pub/kde/stable/([\d\.]*)/src'
@@ -66,6 +80,213 @@ class TestWatch(unittest.TestCase):
         self.assertEqual(repr(w),
                          "Watch(4.10.2, file:///tmp/kde-runtime-4.10.2.tar.xz)")
 
+class TestMatchFilelist(unittest.TestCase):
+    def test_literal_prefix(self):
+        self.assertEqual(literal_prefix(FTP_FILE), 'kde-runtime-')
+        self.assertEqual(literal_prefix('foo\\.bar-(\\d+)'), 'foo.bar-')
+        self.assertEqual(literal_prefix('foos?-(.*)'), 'foo')
+        self.assertEqual(literal_prefix('fo+-(.*)'), 'fo')
+        self.assertEqual(literal_prefix('(foo|bar)-(.*)'), '')
+        self.assertEqual(literal_prefix('[Ff]oo'), '')
+
+    def test_match_filelist(self):
+        patterns = {
+            'kde-runtime': FTP_FILE,
+            'kdelibs': FTP_FILE.replace('kde-runtime', 'kdelibs'),
+            'any': '(.*)-([\\d\\.]*).tar.bz2',
+        }
+        files = ['kde-runtime-4.10.2.tar.xz',
+                 'kde-runtime-4.10.2.tar.xz.sig',
+                 'kdelibs-4.8.2.tar.xz',
+                 'foo-1.0.tar.bz2',
+                 'README']
+        matches = sorted((k, str(v), f)
+                         for k, v, f in match_filelist(patterns, files))
+        self.assertEqual(matches, [
+            ('any', 'foo.1.0', 'foo-1.0.tar.bz2'),
+            ('kde-runtime', '4.10.2', 'kde-runtime-4.10.2.tar.xz'),
+            ('kdelibs', '4.8.2', 'kdelibs-4.8.2.tar.xz'),
+        ])
+
+
+class FakeFTP(object):
+    def __init__(self, tree):
+        self.tree = tree
+        self.listed = []
+        self.directory = None
+
+    def cwd(self, directory):
+        self.directory = directory
+
+    def nlst(self):
+        self.listed.append(self.directory)
+        return self.tree[self.directory]
+
+
+class TestListingCache(unittest.TestCase):
+    def setUp(self):
+        self.ftp = FakeFTP({
+            '/pub/kde/stable': ['4.8.2', '4.10.2', 'README'],
+            '/pub/kde/stable/4.10.2/src': ['kde-runtime-4.10.2.tar.xz',
+                                           'kdelibs-4.10.2.tar.xz'],
+        })
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_shared_listings(self):
+        cache = ListingCache()
+        for name in ('kde-runtime', 'kdelibs'):
+            url = FTP_PATH + '/' + FTP_FILE.replace('kde-runtime', name)
+            version, path = newest_dir(self.ftp, url.split('/'),
+                                       cache, FTP_SITE)
+            self.assertEqual(version, '4.10.2')
+        self.assertEqual(self.ftp.listed, ['/pub/kde/stable',
+                                           '/pub/kde/stable/4.10.2/src'])
+
+    def test_stale(self):
+        cache = ListingCache(ttl=0)
+        cache.listdir(self.ftp, FTP_SITE, '/pub/kde/stable')
+        cache.listdir(self.ftp, FTP_SITE, '/pub/kde/stable')
+        self.assertEqual(len(self.ftp.listed), 2)
+
+    def test_persist(self):
+        filename = os.path.join(self.tempdir, 'listings')
+        cache = ListingCache(filename=filename)
+        cache.listdir(self.ftp, FTP_SITE, '/pub/kde/stable')
+        cache.save()
+
+        cache = ListingCache(filename=filename)
+        self.assertEqual(cache.listdir(self.ftp, FTP_SITE, '/pub/kde/stable'),
+                         ['4.8.2', '4.10.2', 'README'])
+        self.assertEqual(len(self.ftp.listed), 1)
+
+
+@unittest.skipIf(FTPServer is None, 'pyftpdlib is not installed')
+class TestCheckAll(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        for version in ('4.8.2', '4.10.2'):
+            src = os.path.join(self.tempdir, 'pub', 'kde', 'stable',
+                               version, 'src')
+            os.makedirs(src)
+            for name in ('kde-runtime', 'kdelibs'):
+                filename = '{}-{}.tar.xz'.format(name, version)
+                open(os.path.join(src, filename), 'w').close()
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_anonymous(self.tempdir)
+        handler = type('Handler', (FTPHandler,), {'authorizer': authorizer})
+        self.server = FTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'timeout': 0.1})
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.close_all()
+        self.thread.join()
+        shutil.rmtree(self.tempdir)
+
+    def test_check_all(self):
+        host = '127.0.0.1:{}'.format(self.server.address[1])
+        watches = []
+        for name in ('kde-runtime', 'kdelibs', 'missing'):
+            url = FTP_URL.replace(FTP_SITE, host).replace('kde-runtime', name)
+            watches.append(Watch('\n'.join(['version=3', url, ''])))
+
+        versions = check_all(watches, max_workers=3, per_host_limit=2)
+
+        self.assertEqual(versions[:2], ['4.10.2', '4.10.2'])
+        self.assertEqual(versions[2], None)
+        self.assertEqual(watches[0].url.path,
+                         '/pub/kde/stable/4.10.2/src/kde-runtime-4.10.2.tar.xz')
+
+class RecordingHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, code='-', size='-'):
+        self.server.requests.append((self.path, int(code)))
+
+
+class TestHTTP(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='ooddr_')
+        stable = os.path.join(self.tempdir, 'pub', 'kde', 'stable')
+        for version in ('4.8.2', '4.10.2'):
+            src = os.path.join(stable, version, 'src')
+            os.makedirs(src)
+            filename = 'kde-runtime-{}.tar.xz'.format(version)
+            self.write_index(src, [filename, 'kde-runtime-{}.tar.xz.sig'.format(version)])
+        self.write_index(stable, ['../', '4.8.2/', '/pub/kde/stable/4.10.2/',
+                                  'http://elsewhere.example.org/5.0/'])
+
+        handler = partial(RecordingHandler, directory=self.tempdir)
+        self.server = HTTPServer(('127.0.0.1', 0), handler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.1})
+        self.thread.start()
+        self.url = FTP_URL.replace(
+            'ftp://' + FTP_SITE,
+            'http://127.0.0.1:{}'.format(self.server.server_address[1]))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tempdir)
+
+    def write_index(self, dirname, links):
+        with open(os.path.join(dirname, 'index.html'), 'w') as stream:
+            stream.write('<html><body>\n')
+            for link in links:
+                stream.write('<a href="{0}">{0}</a>\n'.format(link))
+            stream.write('</body></html>\n')
+
+    def test_get_latest(self):
+        w = Watch('\n'.join(['version=3', self.url, '']))
+        self.assertEqual(w.get_latest(), '4.10.2')
+        self.assertEqual(w.url.path,
+                         '/pub/kde/stable/4.10.2/src/kde-runtime-4.10.2.tar.xz')
+
+    def test_get_latest_regex(self):
+        foo = os.path.join(self.tempdir, 'pub', 'foo')
+        os.makedirs(foo)
+        self.write_index(foo, ['foo-1.0.tar.gz', 'foo-1.2.tar.gz',
+                               'foo-1.10.tar.gz.sig', '/pub/foo/foo-1.1.tar.gz',
+                               'http://elsewhere.example.org/pub/foo/foo-9.tar.gz'])
+        site = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        w = Watch('\n'.join(['version=3',
+                             site + r'/pub/foo/ foo-(.*)\.tar\.gz', '']))
+        self.assertEqual(w.unresolved_filename, '')
+        self.assertEqual(w.get_latest(), '1.2')
+        self.assertEqual(w.url.path, '/pub/foo/foo-1.2.tar.gz')
+
+    def test_nlst_other_site(self):
+        stable = os.path.join(self.tempdir, 'pub', 'kde', 'stable')
+        self.write_index(stable, ['4.8.2/',
+                                  'http://elsewhere.example.org/pub/kde/stable/5.0/'])
+        pool = HTTPPool()
+        try:
+            directory = HTTPDirectory(pool, urlparse(self.url))
+            directory.cwd('/pub/kde/stable')
+            self.assertEqual(directory.nlst(), ['4.8.2'])
+        finally:
+            pool.close()
+
+    def test_conditional_requests(self):
+        pool = HTTPPool()
+        page = urlparse(self.url).path.split('(')[0]
+        page = urlparse(self.url)._replace(path=page)
+        try:
+            links = pool.get_links(page)
+            self.assertEqual(pool.get_links(page), links)
+        finally:
+            pool.close()
+        self.assertEqual(self.server.requests,
+                         [('/pub/kde/stable/', 200), ('/pub/kde/stable/', 304)])
+
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
 
@@ -0,0 +1,175 @@
+"""Sortable keys for Debian version strings.
+
+version_key turns a Debian version into a byte string whose plain
+byte ordering matches dpkg's version ordering, so whole columns of
+versions can be compared, sorted and grouped with numpy instead of
+calling BaseVersion._compare once per pair.
+
+intern_version returns one shared parsed KeyedVersion, from the
+keyedversion module, per distinct string from a bounded pool, for code
+that needs python-debian version objects, and interned_key caches just
+the keys.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+_PARTS = re.compile(r'(\D*)(\d*)')
+
+# dpkg orders ~ before the end of a string, the end of a string before
+# letters and letters before everything else.
+_TILDE = 1
+_END = 2
+
+
+def _char_order(c):
+    if c == '~':
+        return _TILDE
+    elif c.isalpha():
+        return ord(c)
+    return min(ord(c) + 128, 255)
+
+_ORDER = {chr(c): _char_order(chr(c)) for c in range(128)}
+
+
+def version_string(version):
+    """Return the version string for a string, BaseVersion or changelog
+    """
+    if version is None or isinstance(version, str):
+        return version
+    full_version = getattr(version, 'full_version', None)
+    if full_version is not None:
+        return full_version
+    return str(version)
+
+
+def _encode(part, key):
+    pos = 0
+    while pos < len(part):
+        match = _PARTS.match(part, pos)
+        nondigit, digits = match.groups()
+        pos = match.end()
+        key.extend(_ORDER.get(c, 255) for c in nondigit)
+        key.append(_END)
+        _encode_number(digits, key)
+    key.append(_END)
+
+
+def _encode_number(digits, key):
+    digits = digits.lstrip('0')
+    key.append(len(digits))
+    key.extend(digits.encode('ascii'))
+
+
+def version_key(version):
+    """Return a byte string that sorts like the Debian version
+
+    version may be a string or anything with a full_version attribute,
+    None sorts before every version.
+    """
+    version = version_string(version)
+    if version is None:
+        return b''
+
+    epoch = ''
+    if ':' in version:
+        epoch, version = version.split(':', 1)
+    # dpkg compares a missing revision as 0
+    revision = '0'
+    if '-' in version:
+        version, revision = version.rsplit('-', 1)
+
+    key = bytearray()
+    _encode_number(epoch, key)
+    _encode(version, key)
+    _encode(revision, key)
+    return bytes(key)
+
+
+def version_keys(versions):
+    """Return a numpy array of version_keys for a sequence of versions
+
+    Each distinct version is only encoded once. The result compares
+    element wise with the usual numpy operators and can be passed to
+    argsort.
+    """
+    import numpy as np
+    encoded = {}
+    keys = []
+    for v in versions:
+        v = version_string(v)
+        key = encoded.get(v)
+        if key is None:
+            key = encoded[v] = version_key(v)
+        keys.append(key)
+    return np.array(keys, dtype=bytes)
+
+
+class VersionPool(object):
+    """Share one parsed version per distinct version string
+
+    The versions are KeyedVersions, which compute their version_key
+    once and compare by it. The least recently used ones are forgotten
+    once there are more than maxsize. Keys asked for with key are
+    cached on their own, without parsing a version.
+    """
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self.versions = OrderedDict()
+        self.keys = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.versions)
+
+    def get(self, version):
+        """Return the parsed version for a string
+
+        Raises ValueError for invalid versions, like the version
+        classes do.
+        """
+        with self.lock:
+            parsed = self.versions.get(version)
+            if parsed is not None:
+                self.versions.move_to_end(version)
+                self.hits += 1
+                return parsed
+
+        # python-debian is only loaded once a version is parsed
+        from .keyedversion import KeyedVersion
+        parsed = KeyedVersion(version)
+        with self.lock:
+            self.misses += 1
+            self.versions[version] = parsed
+            if len(self.versions) > self.maxsize:
+                self.versions.popitem(last=False)
+        return parsed
+
+    def key(self, version):
+        """Return the cached version_key of a version string
+
+        Invalid versions get a key too. When maxsize keys are cached
+        they are all forgotten, which is cheaper than keeping them in
+        order of use.
+        """
+        key = self.keys.get(version)
+        if key is None:
+            key = version_key(version)
+            if len(self.keys) >= self.maxsize:
+                self.keys.clear()
+            self.keys[version] = key
+        return key
+
+_POOL = VersionPool()
+
+def intern_version(version):
+    """Return the shared parsed version for a string from the run wide pool
+    """
+    return _POOL.get(version)
+
+def interned_key(version):
+    """Return the version_key of a string, cached in the run wide pool
+    """
+    return _POOL.key(version)
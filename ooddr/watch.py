@@ -1,18 +1,21 @@
 from six import StringIO, string_types
+import abc
 import shlex
 import logging
 import os
 import re
 import ftplib
-
-from debian.debian_support import NativeVersion
-
-try:
-    # python 3
-    from urllib.parse import urlparse, urlunparse, ParseResult
-except ImportError:
-    # python 2
-    from urlparse import urlparse, urlunparse, ParseResult
+import http.client
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from urllib.parse import urlparse, urlunparse, urljoin, unquote, \
+    ParseResult
+
+from .version import intern_version
 
 logger = logging.getLogger(__name__)
 
@@ -132,32 +135,96 @@ class Watch(object):
                 self.options[olist[0]] = olist[1]
 
 
-    def get_latest(self):
+    def get_latest(self, ftp_pool=None, listing_cache=None, http_pool=None):
+        """Look upstream for the newest version matching the watch url
+
+        If an FTPPool or HTTPPool is passed, connections are borrowed
+        from it instead of opening a new connection for this watch, and
+        directory listings are looked up in listing_cache if passed.
+        Returns the version found.
+        """
         url = self.unresolved_url
-        if url.scheme == 'ftp':
-            version, path = open_ftp(url)
-            url = urlunparse((url.scheme,
-                              url.netloc,
-                              path,
-                              url.params,
-                              url.query,
-                              url.fragment,
-                             ))
+        if self.regex and url.scheme in ('http', 'https'):
+            version, link = self.newest_link(http_pool, listing_cache)
             self.version = version
-            self.url = url
+            self.url = urlparse(link) if link is not None else None
+            return version
+        elif url.scheme == 'ftp':
+            if ftp_pool is not None:
+                with ftp_pool.connection(url) as ftp:
+                    version, path = newest_dir(ftp, url.path.split('/'),
+                                               listing_cache, site_name(url))
+            else:
+                version, path = open_ftp(url, listing_cache)
         elif url.scheme in ('http', 'https'):
-            version, path = open_http(url)
-
+            if http_pool is not None:
+                directory = HTTPDirectory(http_pool, url)
+                version, path = newest_dir(directory, url.path.split('/'),
+                                           listing_cache, site_name(url))
+            else:
+                version, path = open_http(url, None, listing_cache)
         else:
             print ('Unsupported:', urlunparse(url))
             return None
 
+        url = ParseResult(url.scheme,
+                          url.netloc,
+                          path,
+                          url.params,
+                          url.query,
+                          url.fragment,
+                         )
+        self.version = version
+        self.url = url
+        return version
+
+
+    def newest_link(self, http_pool=None, listing_cache=None):
+        """Find the newest link matching regex on the unresolved_url page
+
+        That is the usual form of http watch lines, a page followed by
+        a pattern for the links on it, which is tried against the link
+        relative to the page, the path of the link and the whole link.
+        Directories with patterns in the page url are resolved first.
+        Returns the version and the link, or None and None.
+        """
+        pool = http_pool if http_pool is not None else HTTPPool()
+        try:
+            page = self.unresolved_url
+            if '(' in page.path:
+                version, path = newest_dir(HTTPDirectory(pool, page),
+                                           page.path.split('/'),
+                                           listing_cache, site_name(page))
+                page = page._replace(path=path)
+            links = pool.get_links(page)
+        finally:
+            if http_pool is None:
+                pool.close()
+
+        pattern = re.compile(self.regex)
+        page_url = urlunparse(page)
+        base = page_url[:page_url.rindex('/') + 1]
+        candidates = []
+        for link in links:
+            relative = link[len(base):] if link.startswith(base) else None
+            for text in (relative, unquote(urlparse(link).path), link):
+                match = text is not None and pattern.fullmatch(text)
+                if match:
+                    try:
+                        version = intern_version('.'.join(match.groups()))
+                    except ValueError:
+                        continue
+                    candidates.append((version, link))
+                    break
+        if not candidates:
+            return None, None
+        return max(candidates)
 
     def scan_local_dir(self, dirname):
         """Scan a local directory for a matching file
         """
         filelist = os.listdir(dirname)
-        return scan_local_filelist(filelist, dirname)
+        return self.scan_local_filelist(filelist, dirname)
 
     def scan_local_filelist(self, filelist, dirname):
         """Check a list of files for the watch target file name.
@@ -165,13 +232,11 @@ class Watch(object):
         Returns tuple of Version, url
         """
         hits = []
-        for f in filelist:
-            match = re.match(self.unresolved_filename, f)
-            if match:
-                version = '.'.join(match.groups())
-                pathname = os.path.join(dirname,f)
-                url = ParseResult('file','',pathname,'','','')
-                hits.append((NativeVersion(version), url))
+        patterns = {None: self.unresolved_filename}
+        for key, version, f in match_filelist(patterns, filelist):
+            pathname = os.path.join(dirname,f)
+            url = ParseResult('file','',pathname,'','','')
+            hits.append((version, url))
 
         hits.sort()
         if hits:
@@ -180,27 +245,427 @@ class Watch(object):
             return hits[-1]
 
 
-def open_ftp(url):
-    simple_path = []
+_REGEX_META = frozenset('.^$*+?{}[]|()')
+
+def literal_prefix(pattern):
+    """Return the text every match of a regular expression starts with
+    """
+    if '|' in pattern:
+        # alternatives could start with anything
+        return ''
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                break
+            literal = pattern[i + 1]
+            step = 2
+        elif c in _REGEX_META:
+            break
+        else:
+            literal = c
+            step = 1
+        quantifier = pattern[i + step:i + step + 1]
+        if quantifier in ('*', '?', '{'):
+            break
+        prefix.append(literal)
+        if quantifier == '+':
+            break
+        i += step
+    return ''.join(prefix)
+
+
+def match_filelist(patterns, filelist):
+    """Match a list of file names against many watch file patterns at once
+
+    patterns maps a key, such as a source package name, to the
+    unresolved_filename regular expression of its watch file. Each
+    pattern is compiled once and indexed by its literal prefix, so a
+    file is only tried against the patterns it could match.
+
+    Yields a tuple of key, version and file name for every match.
+    """
+    index = {}
+    for key, pattern in patterns.items():
+        if not pattern:
+            continue
+        try:
+            compiled = re.compile(pattern)
+        except re.error as e:
+            logger.warning('Bad watch pattern %s for %s: %s', pattern, key, e)
+            continue
+        index.setdefault(literal_prefix(pattern), []).append((key, compiled))
+    lengths = sorted(set(len(prefix) for prefix in index))
+
+    for f in filelist:
+        for length in lengths:
+            if length > len(f):
+                break
+            for key, compiled in index.get(f[:length], []):
+                match = compiled.fullmatch(f)
+                if match:
+                    try:
+                        version = intern_version('.'.join(match.groups()))
+                    except ValueError:
+                        continue
+                    yield key, version, f
+
+
+def open_ftp(url, listing_cache=None):
     directories = url.path.split('/')
 
-    with ftplib.FTP(url.netloc) as ftp:
-        ftp.login()
-        return newest_dir(ftp, directories)
+    with ftp_connect(url) as ftp:
+        return newest_dir(ftp, directories, listing_cache, site_name(url))
+
+
+def ftp_connect(url, timeout=60):
+    """Open an anonymous ftp connection to the host of url
+    """
+    ftp = ftplib.FTP(timeout=timeout)
+    ftp.connect(url.hostname, url.port or ftplib.FTP_PORT)
+    ftp.login()
+    return ftp
+
 
+def site_name(url):
+    """Return the scheme and host part of a url
+    """
+    return url.scheme + '://' + url.netloc
 
-def newest_dir(conn, directories):
+
+class ConnectionPool(abc.ABC):
+    """Share open connections between threads.
+
+    Connections are kept open per host and handed out again once a
+    watch is done with them. At most per_host_limit connections to
+    any one host are in use at a time. Subclasses say how to open,
+    check and close a connection.
+    """
+    def __init__(self, per_host_limit=2, timeout=60):
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+
+    @abc.abstractmethod
+    def _connect(self, url):
+        """Open a new connection to the host of url
+        """
+
+    def _is_alive(self, conn):
+        return True
+
+    def _close(self, conn):
+        conn.close()
+
+    def _get_slot(self, host):
+        with self._lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host_limit)
+                self._slots[host] = slot
+            return slot
+
+    def _get_idle(self, host):
+        while True:
+            with self._lock:
+                idle = self._idle.get(host)
+                if not idle:
+                    return None
+                conn = idle.pop()
+            if self._is_alive(conn):
+                return conn
+            conn.close()
+
+    @contextmanager
+    def connection(self, url):
+        host = site_name(url)
+        slot = self._get_slot(host)
+        with slot:
+            conn = self._get_idle(host)
+            if conn is None:
+                conn = self._connect(url)
+            try:
+                yield conn
+            except:
+                conn.close()
+                raise
+            with self._lock:
+                self._idle.setdefault(host, []).append(conn)
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for connections in idle.values():
+            for conn in connections:
+                self._close(conn)
+
+
+class FTPPool(ConnectionPool):
+    """Share logged in ftp connections between threads.
+    """
+    def _connect(self, url):
+        return ftp_connect(url, self.timeout)
+
+    def _is_alive(self, conn):
+        try:
+            conn.voidcmd('NOOP')
+            return True
+        except ftplib.all_errors:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.quit()
+        except ftplib.all_errors:
+            conn.close()
+
+
+class LinkParser(HTMLParser):
+    """Collect the targets of the links in an html page
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.links.append(value)
+
+
+class HTTPPool(ConnectionPool):
+    """Share keep-alive http connections between threads.
+
+    Pages are remembered along with their ETag and Last-Modified
+    headers, so fetching them again is a conditional request and an
+    unchanged page costs a 304 instead of a download and a parse.
+    """
+    def __init__(self, per_host_limit=2, timeout=60):
+        ConnectionPool.__init__(self, per_host_limit, timeout)
+        self.pages = {}
+
+    def _connect(self, url):
+        if url.scheme == 'https':
+            connection_class = http.client.HTTPSConnection
+        else:
+            connection_class = http.client.HTTPConnection
+        return connection_class(url.hostname, url.port, timeout=self.timeout)
+
+    def _request(self, url, headers):
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        with self.connection(url) as conn:
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                # the server closed our idle keep-alive connection
+                conn.close()
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            body = response.read()
+            if response.will_close:
+                conn.close()
+        return response, body
+
+    def get_links(self, url):
+        """Return the absolute urls of the links on the page at url
+        """
+        key = urlunparse(url)
+        cached = self.pages.get(key)
+        headers = {}
+        if cached is not None:
+            etag, modified, links = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if modified:
+                headers['If-Modified-Since'] = modified
+
+        response, body = self._request(url, headers)
+        if response.status == 304 and cached is not None:
+            return cached[2]
+        if response.status != 200:
+            raise IOError('{} fetching {}'.format(response.status, key))
+
+        charset = response.headers.get_content_charset() or 'utf-8'
+        parser = LinkParser()
+        parser.feed(body.decode(charset, 'replace'))
+        parser.close()
+        links = [urljoin(key, link) for link in parser.links]
+        self.pages[key] = (response.getheader('ETag'),
+                           response.getheader('Last-Modified'),
+                           links)
+        return links
+
+
+class HTTPDirectory(object):
+    """List the links of web pages like directories on an ftp server
+
+    Has the cwd and nlst methods newest_dir uses from ftplib.FTP.
+    """
+    def __init__(self, http_pool, url):
+        self.http_pool = http_pool
+        self.url = url
+        self.directory = '/'
+
+    def cwd(self, directory):
+        self.directory = directory
+
+    def nlst(self):
+        path = self.directory
+        if not path.endswith('/'):
+            path += '/'
+        page = self.url._replace(path=path, params='', query='', fragment='')
+        names = []
+        for link in self.http_pool.get_links(page):
+            parsed = urlparse(link)
+            if parsed.netloc != self.url.netloc:
+                # the same path on another site isn't in this directory
+                continue
+            link_path = unquote(parsed.path)
+            if link_path.startswith(path) and link_path != path:
+                names.append(link_path[len(path):].rstrip('/'))
+        return names
+
+
+def check_all(watches, max_workers=8, per_host_limit=2, listing_cache=None):
+    """Look for the latest upstream version of many watches at once
+
+    Watches are checked by a pool of max_workers threads that share
+    ftp and http connections, with at most per_host_limit connections
+    to each host. Returns the versions found in the same order as watches,
+    None for watches that couldn't be checked.
+
+    Most watch files point at the same few directories, so a
+    ListingCache is created if one isn't passed.
+    """
+    ftp_pool = FTPPool(per_host_limit)
+    http_pool = HTTPPool(per_host_limit)
+    if listing_cache is None:
+        listing_cache = ListingCache()
+
+    def check(watch):
+        try:
+            return watch.get_latest(ftp_pool, listing_cache, http_pool)
+        except Exception as e:
+            logger.warning('Unable to check %s: %s', watch, e)
+            return None
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(check, watches))
+    finally:
+        ftp_pool.close()
+        http_pool.close()
+
+
+class ListingCache(object):
+    """Remember directory listings by host and directory.
+
+    Listings older than ttl seconds are stale and are listed again
+    the next time they are needed. Only one thread lists a given
+    directory at a time, the others wait for its result. If filename
+    is given listings are loaded from it and saved to it so they can
+    be reused by the next run.
+    """
+    def __init__(self, ttl=3600, filename=None):
+        self.ttl = ttl
+        self.filename = filename
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        if filename is not None and os.path.exists(filename):
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as stream:
+                self.entries = pickle.load(stream)
+        except Exception as e:
+            logger.warning('Ignoring listing cache %s: %s', self.filename, e)
+            self.entries = {}
+
+    def save(self):
+        if self.filename is None:
+            return
+        with self._lock:
+            entries = dict(self.entries)
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'wb') as stream:
+            pickle.dump(entries, stream, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_filename, self.filename)
+
+    def get(self, host, directory):
+        """Return the listing of directory or None if it is missing or stale
+        """
+        entry = self.entries.get((host, directory))
+        if entry is not None and time.time() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def put(self, host, directory, listing):
+        with self._lock:
+            self.entries[(host, directory)] = (time.time(), listing)
+
+    def listdir(self, conn, host, directory):
+        """Return the listing of directory, listing it with conn if needed
+        """
+        listing = self.get(host, directory)
+        if listing is not None:
+            return listing
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault((host, directory),
+                                                  threading.Lock())
+        with key_lock:
+            # someone else may have listed it while we waited
+            listing = self.get(host, directory)
+            if listing is None:
+                listing = ftp_listdir(conn, directory)
+                self.put(host, directory, listing)
+        return listing
+
+
+def ftp_listdir(conn, directory):
+    conn.cwd(directory)
+    return conn.nlst()
+
+
+def open_http(url, http_pool=None, listing_cache=None):
+    if http_pool is None:
+        http_pool = HTTPPool()
+    directories = url.path.split('/')
+    try:
+        return newest_dir(HTTPDirectory(http_pool, url), directories,
+                          listing_cache, site_name(url))
+    finally:
+        http_pool.close()
+
+
+def newest_dir(conn, directories, listing_cache=None, host=None):
     current = []
     version = None
     for d in directories:
         if re.search('\(.*\)', d):
-            conn.cwd('/'.join(current))
+            directory = '/'.join(current) or '/'
+            if listing_cache is not None:
+                listing = listing_cache.listdir(conn, host, directory)
+            else:
+                listing = ftp_listdir(conn, directory)
             candidates = []
-            for f in conn.nlst():
-                match = re.search(d, f)
+            for f in listing:
+                match = re.fullmatch(d, f)
                 if match:
                     try:
-                        version = NativeVersion('.'.join(match.groups()))
+                        version = intern_version('.'.join(match.groups()))
                         candidates.append((version, f))
                     except ValueError as e:
                         pass